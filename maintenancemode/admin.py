@@ -1,23 +1,205 @@
-from django.contrib import admin
-
-from maintenancemode.models import Maintenance, IgnoredURL
-
-
-class IgnoredURLInline(admin.TabularInline):
-    model = IgnoredURL
-    extra = 3
-
-
-class MaintenanceAdmin(admin.ModelAdmin):
-    inlines = [IgnoredURLInline, ]
-    list_display = ['__unicode__', 'is_being_performed']
-    readonly_fields = ('site',)
-    actions = None
-
-    def has_delete_permission(self, request, obj=None):
-        return False
-
-    def has_add_permission(self, request):
-        return False
-
-admin.site.register(Maintenance, MaintenanceAdmin)
+import re
+import time
+
+from django import forms
+from django.conf.urls import url
+from django.contrib import admin, messages
+from django.contrib.admin.utils import unquote
+from django.core.exceptions import PermissionDenied, ValidationError
+from django.http import Http404, HttpResponse, HttpResponseRedirect
+from django.template.response import TemplateResponse
+
+from maintenancemode import bulk, state
+from maintenancemode.models import Maintenance, IgnoredURL, BlockedURL
+
+# Above this many ignored URLs, they are edited in their own admin instead of inline
+MAX_INLINE_IGNORED_URLS = 50
+
+METHODS = ('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE')
+
+
+class BatchedChangesMixin(object):
+    """ Announce the state changes of a whole admin page (rows, inlines, actions) once. """
+
+    def changeform_view(self, *args, **kwargs):
+        with state.batched_changes():
+            return super(BatchedChangesMixin, self).changeform_view(*args, **kwargs)
+
+    def changelist_view(self, *args, **kwargs):
+        with state.batched_changes():
+            return super(BatchedChangesMixin, self).changelist_view(*args, **kwargs)
+
+    def delete_view(self, *args, **kwargs):
+        with state.batched_changes():
+            return super(BatchedChangesMixin, self).delete_view(*args, **kwargs)
+
+
+class IgnoredURLInline(admin.TabularInline):
+    model = IgnoredURL
+    extra = 1
+
+
+class BlockedURLInline(admin.TabularInline):
+    model = BlockedURL
+    extra = 1
+
+
+class ImportForm(forms.Form):
+    format = forms.ChoiceField(choices=bulk.FORMAT_CHOICES)
+    file = forms.FileField(required=False)
+    text = forms.CharField(required=False, widget=forms.Textarea(attrs={'rows': 15, 'cols': 80}),
+                           help_text='Or paste the patterns here.')
+    replace = forms.BooleanField(required=False, help_text='Delete the existing ignored URLs first.')
+
+    def clean(self):
+        data = super(ImportForm, self).clean()
+        if data.get('file'):
+            try:
+                data['text'] = data['file'].read().decode('utf-8')
+            except UnicodeDecodeError:
+                raise ValidationError('The file must be UTF-8 encoded.')
+        if not data.get('text'):
+            raise ValidationError('Upload a file or paste the patterns.')
+        return data
+
+
+class PatternTestForm(forms.Form):
+    path = forms.CharField(initial='/', help_text='Like request.path_info, e.g. /api/v1/status/')
+    method = forms.ChoiceField(choices=[(method, method) for method in METHODS])
+
+
+class MaintenanceAdmin(BatchedChangesMixin, admin.ModelAdmin):
+    inlines = [IgnoredURLInline, BlockedURLInline]
+    list_display = ['__unicode__', 'is_being_performed', 'mode', 'scheduled_start', 'scheduled_end',
+                    'recurrence']
+    fieldsets = (
+        (None, {'fields': ('site', 'is_being_performed', 'mode')}),
+        ('Scheduled maintenance', {
+            'fields': ('scheduled_start', 'scheduled_end', 'recurrence', 'timezone'),
+        }),
+        ('Gradual ramp', {
+            'fields': ('ramp_start', 'ramp_end', 'ramp_from', 'ramp_to'),
+            'description': 'Give the maintenance page to a growing (or shrinking) percentage of '
+                           'clients, moving linearly from the start to the end of the ramp.',
+        }),
+    )
+    readonly_fields = ('site',)
+    actions = None
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_inline_instances(self, request, obj=None):
+        inlines = super(MaintenanceAdmin, self).get_inline_instances(request, obj)
+        if obj is not None and obj.ignoredurl_set.count() > MAX_INLINE_IGNORED_URLS:
+            inlines = [inline for inline in inlines if not isinstance(inline, IgnoredURLInline)]
+        return inlines
+
+    def change_view(self, request, object_id, form_url='', extra_context=None):
+        extra_context = dict(extra_context or {}, max_inline_ignored_urls=MAX_INLINE_IGNORED_URLS,
+                             ignored_url_count=IgnoredURL.objects.filter(maintenance=object_id).count())
+        return super(MaintenanceAdmin, self).change_view(request, object_id, form_url, extra_context)
+
+    def get_urls(self):
+        info = self.model._meta.app_label, self.model._meta.model_name
+        return [
+            url(r'^(.+)/ignored-urls/import/$', self.admin_site.admin_view(self.import_view),
+                name='%s_%s_import_ignored_urls' % info),
+            url(r'^(.+)/ignored-urls/export/$', self.admin_site.admin_view(self.export_view),
+                name='%s_%s_export_ignored_urls' % info),
+            url(r'^(.+)/test-pattern/$', self.admin_site.admin_view(self.test_pattern_view),
+                name='%s_%s_test_pattern' % info),
+        ] + super(MaintenanceAdmin, self).get_urls()
+
+    def _get_changeable_object(self, request, object_id):
+        obj = self.get_object(request, unquote(object_id))
+        if obj is None:
+            raise Http404
+        if not self.has_change_permission(request, obj):
+            raise PermissionDenied
+        return obj
+
+    def _render(self, request, template, obj, **context):
+        try:
+            context.update(self.admin_site.each_context(request))
+        except TypeError:  # Django<1.8
+            context.update(self.admin_site.each_context())
+        context.update(opts=self.model._meta, original=obj)
+        return TemplateResponse(request, 'admin/maintenancemode/maintenance/%s' % template, context)
+
+    def import_view(self, request, object_id):
+        obj = self._get_changeable_object(request, object_id)
+        form = ImportForm(request.POST or None, request.FILES or None)
+        if form.is_valid():
+            try:
+                created = bulk.import_ignored_urls(obj, form.cleaned_data['text'], form.cleaned_data['format'],
+                                                   replace=form.cleaned_data['replace'])
+            except ValidationError as e:
+                form.add_error(None, e)
+            else:
+                messages.success(request, 'Imported %d ignored URL(s).' % created)
+                return HttpResponseRedirect('../../')
+        return self._render(request, 'import_ignored_urls.html', obj, form=form,
+                            title='Import ignored URLs of %s' % obj)
+
+    def export_view(self, request, object_id):
+        obj = self._get_changeable_object(request, object_id)
+        format = request.GET.get('format', bulk.CSV)
+        if format not in dict(bulk.FORMAT_CHOICES):
+            raise Http404
+        content_type = 'application/json' if format == bulk.JSON else 'text/csv'
+        response = HttpResponse(bulk.export_ignored_urls(obj, format), content_type=content_type)
+        response['Content-Disposition'] = 'attachment; filename="ignored-urls-%s.%s"' % (
+            obj.site.domain, format)
+        return response
+
+    def test_pattern_view(self, request, object_id, repeat=1000):
+        """ Which rules match a path, and how long the matching takes. """
+        obj = self._get_changeable_object(request, object_id)
+        form = PatternTestForm(request.GET or None)
+        result = None
+        if form.is_valid():
+            path, method = form.cleaned_data['path'], form.cleaned_data['method']
+            site_state = state.get_snapshot().get(obj.site_id)
+            ignore_urls, blocked_urls = site_state.ignore_urls, site_state.blocked_urls
+
+            start = time.time()
+            for i in range(repeat):
+                ignore_urls.match(path)
+            matcher_time = (time.time() - start) / repeat
+            compiled = [re.compile(pattern) for pattern in ignore_urls.patterns]
+            start = time.time()
+            for i in range(repeat):
+                any(regex.match(path) for regex in compiled)
+            naive_time = (time.time() - start) / repeat
+
+            # Without the exemptions of a request: permission processors, networks, bypass tokens
+            subject_to_maintenance = site_state.blocks(method, path)
+            ignored_by = ignore_urls.match(path)
+            rate_limit = site_state.rate_limits.get(ignored_by)
+            result = {
+                'blocks': subject_to_maintenance and ignored_by is None,
+                'subject_to_maintenance': subject_to_maintenance,
+                'rate_limit': (int(round(rate_limit[0] * 60)), int(rate_limit[1])) if rate_limit else None,
+                'ignored_by': ignored_by,
+                'blocked_by': blocked_urls.match(method, path) if blocked_urls else None,
+                'pattern_count': len(ignore_urls.patterns),
+                'matcher_us': matcher_time * 1e6,
+                'naive_us': naive_time * 1e6,
+            }
+        return self._render(request, 'test_pattern.html', obj, form=form, result=result,
+                            title='Test URL patterns of %s' % obj)
+
+
+class IgnoredURLAdmin(BatchedChangesMixin, admin.ModelAdmin):
+    list_display = ['pattern', 'description', 'rate_limit', 'burst', 'maintenance']
+    list_filter = ['maintenance']
+    list_select_related = ['maintenance__site']
+    search_fields = ['pattern', 'description']
+    list_per_page = 100
+
+admin.site.register(Maintenance, MaintenanceAdmin)
+admin.site.register(IgnoredURL, IgnoredURLAdmin)
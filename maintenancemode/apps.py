@@ -0,0 +1,22 @@
+from django.apps import AppConfig
+from django.db.models.signals import post_save, post_delete
+
+
+class MaintenanceModeConfig(AppConfig):
+    name = 'maintenancemode'
+    verbose_name = 'Maintenance Mode'
+
+    def ready(self):
+        from django.contrib.sites.models import Site
+        from maintenancemode.state import _state_changed_on_save
+
+        # Any change of the models drops the cached state, see maintenancemode.state
+        for model_name in ('Maintenance', 'IgnoredURL', 'BlockedURL'):
+            model = self.get_model(model_name)
+            post_save.connect(_state_changed_on_save, sender=model,
+                              dispatch_uid='maintenancemode.state.%s_saved' % model_name.lower())
+            post_delete.connect(_state_changed_on_save, sender=model,
+                                dispatch_uid='maintenancemode.state.%s_deleted' % model_name.lower())
+        # The state is looked up by domain, and remembers hosts which are no site
+        post_save.connect(_state_changed_on_save, sender=Site, dispatch_uid='maintenancemode.state.site_saved')
+        post_delete.connect(_state_changed_on_save, sender=Site, dispatch_uid='maintenancemode.state.site_deleted')
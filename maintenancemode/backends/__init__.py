@@ -0,0 +1,21 @@
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from maintenancemode.conf import settings as app_settings, setting_changed
+
+_backend = None
+
+
+def get_backend():
+    """ Return the configured MAINTENANCE_MODE_STATE_BACKEND instance. """
+    global _backend
+    if _backend is None:
+        _backend = import_string(app_settings.STATE_BACKEND)()
+    return _backend
+
+
+@receiver(setting_changed, dispatch_uid='maintenancemode.backends.reset_backend')
+def _reset_backend(setting, **kwargs):
+    global _backend
+    if setting.startswith(app_settings.prefix):
+        _backend = None
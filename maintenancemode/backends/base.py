@@ -0,0 +1,107 @@
+import logging
+import time
+from itertools import groupby
+from operator import itemgetter
+
+from django.db.utils import DatabaseError
+from django.utils import timezone
+
+from maintenancemode.conf import settings as app_settings
+from maintenancemode.models import Maintenance, BlockedURL, get_rate_limit, parse_methods
+from maintenancemode.schedule import to_timestamp
+from maintenancemode.state import MaintenanceState, MaintenanceSnapshot
+
+logger = logging.getLogger('maintenancemode')
+
+
+class BaseStateBackend(object):
+    """
+    A state backend tells the middleware where the maintenance state lives.
+
+    ``get_generation`` should be cheap: it is called once per STATE_TTL by every
+    worker, and the state of all sites is only loaded when the returned value changes.
+    A generation of None means "unknown", so the state is reloaded every STATE_TTL.
+
+    ``ttl``, if not None, is the number of seconds to trust the state for
+    instead of STATE_TTL (and EVENT_FALLBACK_TTL), for backends whose changes
+    publish no events and have their own check interval.
+    """
+
+    ttl = None
+
+    def get_generation(self):
+        return None
+
+    def bump_generation(self):
+        """ Announce to all workers that the maintenance state has changed. """
+        return None
+
+    def _initial_generation(self):
+        # Not starting from 1 so that a lost generation (an evicted cache key, a
+        # deleted file) can't bring back a generation some worker has already seen.
+        return int(time.time() * 1000)
+
+    def load(self, generation=None):
+        """
+        Read the maintenance state of all sites from the database: Maintenance
+        records with their ignored URLs in one query, blocked URLs in another.
+        If the database can't be read, DATABASE_ERROR_POLICY decides: 'open'
+        lets requests through, 'closed' shows the 503 page.
+        """
+        try:
+            rows = list(Maintenance.objects.order_by('pk', 'ignoredurl__pk').values_list(
+                'pk', 'site_id', 'site__domain', 'is_being_performed', 'mode', 'scheduled_start',
+                'scheduled_end', 'recurrence', 'timezone', 'ramp_start', 'ramp_end', 'ramp_from',
+                'ramp_to', 'ignoredurl__pattern', 'ignoredurl__rate_limit', 'ignoredurl__burst',
+            ))
+            blocked_urls = {}
+            for maintenance_id, pattern, methods in BlockedURL.objects.filter(
+                    is_active=True).order_by('pk').values_list('maintenance_id', 'pattern', 'methods'):
+                blocked_urls.setdefault(maintenance_id, []).append(
+                    (pattern, parse_methods(methods)))
+        except DatabaseError:
+            logger.warning('Could not read the maintenance state', exc_info=True)
+            # No generation, so that the state is read again after STATE_TTL
+            return MaintenanceSnapshot(default=MaintenanceState(
+                is_being_performed=app_settings.DATABASE_ERROR_POLICY == 'closed',
+            ))
+
+        states = []
+        for maintenance_id, site_rows in groupby(rows, key=itemgetter(0)):
+            site_rows = list(site_rows)
+            fields = site_rows[0]
+            maintenance = Maintenance(
+                pk=maintenance_id, site_id=fields[1], is_being_performed=fields[3], mode=fields[4],
+                scheduled_start=fields[5], scheduled_end=fields[6], recurrence=fields[7], timezone=fields[8],
+                ramp_start=fields[9], ramp_end=fields[10], ramp_from=fields[11], ramp_to=fields[12],
+            )
+            is_being_performed, next_transition, ends_at = self.scheduled(maintenance)
+            ignored = [row[13:] for row in site_rows if row[13] is not None]
+            states.append(MaintenanceState(
+                site_id=maintenance.site_id,
+                domain=fields[2],
+                maintenance_id=maintenance_id,
+                is_being_performed=is_being_performed,
+                ignored_patterns=[pattern for pattern, rate_limit, burst in ignored],
+                next_transition=next_transition,
+                ends_at=ends_at,
+                blocked_urls=blocked_urls.get(maintenance_id, ()),
+                read_only=maintenance.mode == Maintenance.READ_ONLY,
+                ramp=maintenance.get_ramp(),
+                rate_limits=dict((pattern, get_rate_limit(rate_limit, burst))
+                                 for pattern, rate_limit, burst in ignored if rate_limit),
+            ))
+        return MaintenanceSnapshot(states, generation=generation)
+
+    @staticmethod
+    def scheduled(maintenance):
+        """
+        Return ``(is_being_performed, next transition, end)`` of ``maintenance``,
+        taking its schedule into account. Times are timestamps, or None.
+        """
+        schedule = maintenance.get_schedule()
+        if schedule is None:
+            return maintenance.is_being_performed, None, None
+        active, transition = schedule.window(timezone.now())
+        transition = to_timestamp(transition) if transition is not None else None
+        return maintenance.is_being_performed or active, transition, transition if active else None
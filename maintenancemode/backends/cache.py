@@ -0,0 +1,30 @@
+from django.core.cache import caches
+
+from maintenancemode.backends.base import BaseStateBackend
+from maintenancemode.conf import settings as app_settings
+
+
+class CacheBackend(BaseStateBackend):
+    """
+    Keeps the state generation in Django's cache framework, shared by all
+    workers using the STATE_CACHE_ALIAS cache (e.g. memcached or redis).
+    """
+
+    def __init__(self):
+        self.cache = caches[app_settings.STATE_CACHE_ALIAS]
+        self.key = app_settings.STATE_CACHE_KEY
+
+    def get_generation(self):
+        generation = self.cache.get(self.key)
+        if generation is None:
+            self.cache.add(self.key, self._initial_generation(), timeout=None)
+            generation = self.cache.get(self.key)
+        return generation
+
+    def bump_generation(self):
+        try:
+            return self.cache.incr(self.key)
+        except ValueError:  # key is missing
+            generation = self._initial_generation()
+            self.cache.set(self.key, generation, timeout=None)
+            return generation
@@ -0,0 +1,8 @@
+from maintenancemode.backends.base import BaseStateBackend
+
+
+class DatabaseBackend(BaseStateBackend):
+    """
+    Reads the state straight from the database every STATE_TTL seconds.
+    Changes made in other processes show up after at most STATE_TTL seconds.
+    """
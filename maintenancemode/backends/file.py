@@ -0,0 +1,76 @@
+import logging
+import os
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from maintenancemode.backends.base import BaseStateBackend
+from maintenancemode.conf import settings as app_settings
+
+logger = logging.getLogger('maintenancemode')
+
+
+class FileBackend(BaseStateBackend):
+    """
+    Keeps the state generation in a small file shared by all workers on a host.
+    Point STATE_FILE to a tmpfs such as /dev/shm to keep it in shared memory.
+    """
+
+    def __init__(self):
+        self.path = app_settings.STATE_FILE or os.path.join(
+            tempfile.gettempdir(), 'maintenancemode.generation')
+        self._generation = None
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return int(f.read().strip())
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _write(self, generation):
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.')
+        with os.fdopen(fd, 'w') as f:
+            f.write(str(generation))
+        # Readable by workers running as another user than the one bumping it
+        os.chmod(tmp_path, 0o644)
+        os.rename(tmp_path, self.path)
+
+    @contextmanager
+    def _locked(self):
+        with open(self.path + '.lock', 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def get_generation(self):
+        generation = self._read()
+        if generation is None:
+            try:
+                with self._locked():
+                    generation = self._read()
+                    if generation is None:
+                        generation = self._initial_generation()
+                        self._write(generation)
+            except (IOError, OSError):
+                # Don't fail the request, use the generation seen last
+                logger.warning('Could not write the maintenance state generation file %s',
+                               self.path, exc_info=True)
+                return self._generation
+        self._generation = generation
+        return generation
+
+    def bump_generation(self):
+        with self._locked():
+            generation = self._read()
+            generation = self._initial_generation() if generation is None else generation + 1
+            self._write(generation)
+        return generation
@@ -0,0 +1,143 @@
+import json
+import logging
+import operator
+import os
+import time
+from functools import reduce
+
+from django.db.models import Q
+from django.db.utils import DatabaseError
+from django.utils import six, timezone
+from django.utils.dateparse import parse_datetime
+
+from maintenancemode.backends.base import BaseStateBackend
+from maintenancemode.conf import settings as app_settings
+from maintenancemode.models import Maintenance
+from maintenancemode.schedule import to_timestamp
+from maintenancemode.state import MaintenanceState, MaintenanceSnapshot
+
+logger = logging.getLogger('maintenancemode')
+
+OFF = 'off'
+
+
+class FlagFileBackend(BaseStateBackend):
+    """
+    Reads the maintenance state from the JSON file MAINTENANCE_MODE_FLAG_FILE
+    instead of the database, so maintenance can be turned on while the database
+    is down. No file means no maintenance. For example::
+
+        {
+            "mode": "full",
+            "ignored_urls": ["^/health/"],
+            "end": "2015-06-10T04:00:00Z",
+            "sites": {
+                "shop.example.com": {"mode": "read_only"}
+            }
+        }
+
+    ``mode`` is "off", "full" or "read_only", ``end`` an ISO 8601 date or a
+    timestamp after which maintenance is over. ``sites`` overrides these for
+    sites by domain or id (domains are resolved to ids with the Site table if
+    it can be read). An invalid file follows DATABASE_ERROR_POLICY. The file's modification time is checked
+    every FLAG_FILE_CHECK_INTERVAL seconds (instead of STATE_TTL), and it is only
+    parsed when it changed.
+    """
+
+    def __init__(self):
+        self.path = app_settings.FLAG_FILE
+        # Edits of the file publish no events, the state is checked on this interval instead
+        self.ttl = app_settings.FLAG_FILE_CHECK_INTERVAL
+
+    def get_generation(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return 'missing'
+        return (stat.st_mtime, stat.st_size, stat.st_ino)
+
+    def load(self, generation=None):
+        try:
+            with open(self.path) as f:
+                flags = json.load(f)
+        except (IOError, OSError):
+            return MaintenanceSnapshot(generation=generation, default=MaintenanceState())
+        except ValueError:
+            return self.invalid()
+        try:
+            return self.make_snapshot(flags, generation)
+        except (ValueError, TypeError, AttributeError):
+            return self.invalid()
+
+    def invalid(self):
+        """ The snapshot of an unreadable flag file: DATABASE_ERROR_POLICY decides. """
+        logger.warning('Invalid maintenance flag file %s', self.path, exc_info=True)
+        # No generation, so that the file is read again after FLAG_FILE_CHECK_INTERVAL
+        return MaintenanceSnapshot(default=MaintenanceState(
+            is_being_performed=app_settings.DATABASE_ERROR_POLICY == 'closed',
+        ))
+
+    def make_snapshot(self, flags, generation):
+        if not isinstance(flags, dict):
+            raise ValueError('The flag file must hold an object')
+        overrides = flags.get('sites', {})
+        if not isinstance(overrides, dict) or \
+                not all(isinstance(site_flags, dict) for site_flags in overrides.values()):
+            raise ValueError('Invalid sites: %r' % (overrides,))
+        site_ids = self.get_site_ids([key for key in overrides if not key.isdigit()])
+        states = []
+        for key, site_flags in sorted(overrides.items(), key=lambda item: item[0].isdigit()):
+            site_flags = dict(flags, **site_flags)
+            if key.isdigit():
+                states.append(self.make_state(site_flags, site_id=int(key)))
+            else:
+                states.append(self.make_state(site_flags, site_id=site_ids.get(key.lower()), domain=key))
+        return MaintenanceSnapshot(states, generation=generation, default=self.make_state(flags))
+
+    @staticmethod
+    def get_site_ids(domains):
+        """
+        The ids of the sites of ``domains``, by lowercase domain, so that overrides
+        by domain apply with SITE_ID set too. Without the database, overrides by
+        domain only apply to sites looked up by host.
+        """
+        if not domains:
+            return {}
+        from django.contrib.sites.models import Site
+        try:
+            lookup = reduce(operator.or_, [Q(domain__iexact=domain) for domain in domains])
+            return dict((domain.lower(), pk)
+                        for domain, pk in Site.objects.filter(lookup).values_list('domain', 'pk'))
+        except DatabaseError:
+            logger.warning('Could not read the sites of the maintenance flag file', exc_info=True)
+            return {}
+
+    @staticmethod
+    def make_state(flags, **kwargs):
+        mode = flags.get('mode', Maintenance.FULL)
+        if mode not in (OFF, Maintenance.FULL, Maintenance.READ_ONLY):
+            raise ValueError('Invalid mode: %r' % (mode,))
+        # A string would be taken for a list of one character patterns, "^" matching everything
+        ignored_urls = flags.get('ignored_urls', [])
+        if not isinstance(ignored_urls, list) or \
+                not all(isinstance(pattern, six.string_types) for pattern in ignored_urls):
+            raise ValueError('Invalid ignored_urls: %r' % (ignored_urls,))
+        end = flags.get('end')
+        if isinstance(end, (int, float)) or end is None:
+            ends_at = end
+        else:
+            parsed = parse_datetime(end)
+            if parsed is None:
+                raise ValueError('Invalid end: %r' % (end,))
+            if timezone.is_naive(parsed) and timezone.is_aware(timezone.now()):
+                parsed = timezone.make_aware(parsed, timezone.get_default_timezone())
+            ends_at = to_timestamp(parsed)
+        is_being_performed = mode != OFF and (ends_at is None or time.time() < ends_at)
+        return MaintenanceState(
+            is_being_performed=is_being_performed,
+            read_only=mode == Maintenance.READ_ONLY,
+            ignored_patterns=ignored_urls,
+            next_transition=ends_at if is_being_performed else None,
+            ends_at=ends_at if is_being_performed else None,
+            **kwargs
+        )
@@ -0,0 +1,110 @@
+"""
+Import and export of ignored URLs as CSV or JSON, used by the admin.
+
+CSV rows are ``pattern,description,rate_limit,burst`` (the last two may be
+empty), with an optional header row. JSON is a list of objects with the same
+keys.
+"""
+import csv
+import io
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.utils import six
+
+from maintenancemode import state
+from maintenancemode.models import IgnoredURL
+
+CSV, JSON = 'csv', 'json'
+FORMAT_CHOICES = ((CSV, 'CSV'), (JSON, 'JSON'))
+FIELDS = ('pattern', 'description', 'rate_limit', 'burst')
+
+
+def _read_csv(text):
+    if six.PY2:  # the csv module of Python 2 only reads bytes
+        rows = csv.reader(text.encode('utf-8').splitlines())
+        return [[cell.decode('utf-8') for cell in row] for row in rows]
+    return list(csv.reader(text.splitlines()))
+
+
+def _write_csv(rows):
+    if six.PY2:
+        output = io.BytesIO()
+        writer = csv.writer(output)
+        for row in rows:
+            writer.writerow([six.text_type(cell).encode('utf-8') for cell in row])
+        return output.getvalue().decode('utf-8')
+    output = io.StringIO()
+    writer = csv.writer(output)
+    for row in rows:
+        writer.writerow(row)
+    return output.getvalue()
+
+
+def parse(text, format):
+    """ Return the ``{field: value}`` dicts of ``text``, raise ValidationError if it is malformed. """
+    if format == JSON:
+        try:
+            records = json.loads(text)
+        except ValueError as e:
+            raise ValidationError('Invalid JSON: %s' % e)
+        if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+            raise ValidationError('Expected a list of objects.')
+        return records
+    try:
+        rows = [row for row in _read_csv(text) if row]
+    except csv.Error as e:
+        raise ValidationError('Invalid CSV: %s' % e)
+    if rows and rows[0][:1] == ['pattern']:
+        rows = rows[1:]
+    return [dict(zip(FIELDS, row)) for row in rows]
+
+
+def build(maintenance, records):
+    """
+    Return unsaved IgnoredURLs of ``maintenance`` for ``records``, validated like
+    in the admin. Raise a ValidationError listing the errors of every invalid record.
+    """
+    ignored_urls, errors = [], []
+    for number, record in enumerate(records, 1):
+        ignored_url = IgnoredURL(
+            maintenance=maintenance,
+            pattern=record.get('pattern') or '',
+            description=record.get('description') or '',
+            rate_limit=record.get('rate_limit') or None,
+            burst=record.get('burst') or None,
+        )
+        try:
+            ignored_url.full_clean(exclude=['maintenance'])
+        except ValidationError as e:
+            errors.extend('Row %d (%s): %s' % (number, ignored_url.pattern, '; '.join(messages))
+                          for messages in e.message_dict.values())
+        ignored_urls.append(ignored_url)
+    if errors:
+        raise ValidationError(errors)
+    return ignored_urls
+
+
+def import_ignored_urls(maintenance, text, format, replace=False):
+    """
+    Create the ignored URLs of ``text`` with a single INSERT, after deleting the
+    existing ones if ``replace``. The state is announced as changed once.
+    Return the number of created ignored URLs.
+    """
+    ignored_urls = build(maintenance, parse(text, format))
+    with state.batched_changes():
+        with transaction.atomic():
+            if replace:
+                maintenance.ignoredurl_set.all().delete()
+            IgnoredURL.objects.bulk_create(ignored_urls)
+        state.state_changed()  # bulk_create() sends no signals
+    return len(ignored_urls)
+
+
+def export_ignored_urls(maintenance, format):
+    """ The ignored URLs of ``maintenance`` as CSV or JSON text. """
+    rows = maintenance.ignoredurl_set.order_by('pk').values_list(*FIELDS)
+    if format == JSON:
+        return json.dumps([dict(zip(FIELDS, row)) for row in rows], indent=2)
+    return _write_csv([FIELDS] + [['' if cell is None else cell for cell in row] for row in rows])
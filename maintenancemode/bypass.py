@@ -0,0 +1,50 @@
+"""
+Signed, expiring tokens letting QA and monitoring through maintenance without
+logging in. A token is created with ``manage.py maintenance token`` and given in
+the BYPASS_PARAM query parameter; it is then kept in the BYPASS_COOKIE cookie
+until it expires. Tokens are checked with SECRET_KEY only, without the database.
+"""
+from django.core import signing
+
+from maintenancemode.conf import settings as app_settings
+
+SALT = 'maintenancemode.bypass'
+
+
+def make_token(label=''):
+    """ A new token, ``label`` (like 'qa') is only there to tell tokens apart. """
+    return signing.TimestampSigner(salt=SALT).sign(label)
+
+
+def verify_token(token):
+    """ Whether ``token`` is signed with our SECRET_KEY and younger than BYPASS_MAX_AGE. """
+    try:
+        signing.TimestampSigner(salt=SALT).unsign(token, max_age=app_settings.BYPASS_MAX_AGE)
+    except signing.BadSignature:  # also SignatureExpired
+        return False
+    return True
+
+
+def get_new_token(request):
+    """ The valid token in the query parameter of ``request``, which is not in its cookie yet. """
+    token = request.GET.get(app_settings.BYPASS_PARAM)
+    if token and token != request.COOKIES.get(app_settings.BYPASS_COOKIE) and verify_token(token):
+        return token
+    return None
+
+
+def has_valid_token(request):
+    """ Whether ``request`` has a valid token, in its cookie or in the query parameter. """
+    token = request.COOKIES.get(app_settings.BYPASS_COOKIE)
+    if token and verify_token(token):
+        return True
+    return get_new_token(request) is not None
+
+
+def set_cookie(request, response):
+    """ Keep the token of the query parameter of ``request`` in a cookie. """
+    token = get_new_token(request)
+    if token is not None:
+        response.set_cookie(app_settings.BYPASS_COOKIE, token, max_age=app_settings.BYPASS_MAX_AGE,
+                            secure=request.is_secure(), httponly=True)
+    return response
@@ -1,18 +1,85 @@
+try:
+    from django.core.signals import setting_changed
+except ImportError:  # Django<1.8
+    from django.test.signals import setting_changed
+from django.dispatch import receiver
+
 
 class Settings(object):
 
     prefix = 'MAINTENANCE_MODE'
 
     defaults = {
+        # IPv4/IPv6 networks (e.g. '10.0.0.0/8') which can use the site during maintenance,
+        # and proxies whose X-Forwarded-For header is trusted, see maintenancemode.networks.
+        'ALLOWED_NETWORKS': (),
+        'TRUSTED_PROXIES': (),
         'PERMISSION_PROCESSORS': (
             'maintenancemode.permission_processors.is_staff',
         ),
+        # 'open' or 'closed': whether to let requests through when the state can't be read.
+        'DATABASE_ERROR_POLICY': 'open',
+        # Query parameter and cookie of the tokens of maintenancemode.bypass, valid for BYPASS_MAX_AGE seconds.
+        'BYPASS_PARAM': 'maintenance_bypass',
+        'BYPASS_COOKIE': 'maintenance_bypass',
+        'BYPASS_MAX_AGE': 24 * 60 * 60,
+        # Directory where the static 503 pages and nginx map are written on every state change,
+        # see maintenancemode.export. 503 pages are written for LANGUAGE_CODE and EXPORT_LANGUAGES.
+        'EXPORT_ROOT': None,
+        'EXPORT_LANGUAGES': (),
+        # Callables receiving every decision of the middleware, see maintenancemode.metrics.
+        'METRICS_SINKS': (),
+        # Database alias for reads during read-only maintenance, see maintenancemode.routers.
+        'READ_ONLY_DATABASE': None,
+        # Log processors slower than SLOW_PROCESSOR_THRESHOLD seconds, see maintenancemode.registry.
+        'PROCESSOR_TIMING': False,
+        'SLOW_PROCESSOR_THRESHOLD': 0.01,
+        # Cache sharing the rate limits of ignored URLs between processes, see maintenancemode.ratelimit.
+        'RATE_LIMIT_CACHE_ALIAS': None,
+        # Cookie keeping the bucket of a client during a ramp, see maintenancemode.ramp.
+        'RAMP_COOKIE': 'maintenance_bucket',
+        'RAMP_COOKIE_MAX_AGE': 7 * 24 * 60 * 60,
+        # Render the 503 page once per site, language and state, see views.defaults.
+        'RESPONSE_CACHE': False,
+        'RESPONSE_MAX_AGE': 5,
+        # Seconds (or a datetime) sent in the Retry-After header of the 503 page.
+        'RETRY_AFTER': None,
+        # Seconds a process trusts its cached maintenance state before re-reading it.
+        # Changes made through the ORM in the same process take effect immediately.
+        'STATE_TTL': 5,
+        # Where workers look for state changes, see maintenancemode.backends.
+        'STATE_BACKEND': 'maintenancemode.backends.database.DatabaseBackend',
+        'STATE_CACHE_ALIAS': 'default',
+        'STATE_CACHE_KEY': 'maintenancemode:generation',
+        'STATE_FILE': None,
+        # Channel of state change events, see maintenancemode.events. While a process listens,
+        # it checks the state backend every EVENT_FALLBACK_TTL seconds only.
+        'EVENT_CHANNEL': None,
+        'EVENT_SOCKET_DIR': None,
+        'EVENT_DATABASE_ALIAS': 'default',
+        'EVENT_FALLBACK_TTL': 60,
+        # JSON file holding the state of the flag file backend, see maintenancemode.backends.flagfile.
+        'FLAG_FILE': None,
+        'FLAG_FILE_CHECK_INTERVAL': 1,
     }
 
     def __getattr__(self, item):
         from django.conf import settings
         if item in self.defaults:
-            return getattr(settings, '{}_{}'.format(self.prefix, item), self.defaults[item])
-        raise AttributeError
+            value = getattr(settings, '{}_{}'.format(self.prefix, item), self.defaults[item])
+            # Cache the value on the instance, __getattr__ is not called again until reload()
+            setattr(self, item, value)
+            return value
+        raise AttributeError(item)
+
+    def reload(self):
+        for item in self.defaults:
+            self.__dict__.pop(item, None)
 
 settings = Settings()
+
+
+@receiver(setting_changed, dispatch_uid='maintenancemode.conf.reload_settings')
+def _reload_settings(setting, **kwargs):
+    if setting.startswith(settings.prefix):
+        settings.reload()
@@ -0,0 +1,296 @@
+"""
+Push-based invalidation: when the maintenance state changes, an event is
+published on MAINTENANCE_MODE_EVENT_CHANNEL, and a background thread of every
+process reloads its snapshot as soon as it gets it. While that thread listens,
+requests don't check the state backend every STATE_TTL seconds, only every
+EVENT_FALLBACK_TTL seconds in case an event got lost.
+
+Channels:
+
+- ``maintenancemode.events.InMemoryChannel``, within one process, for tests.
+- ``maintenancemode.events.UnixSocketChannel``, datagrams to every process on
+  the host listening in EVENT_SOCKET_DIR.
+- ``maintenancemode.events.PostgresChannel``, LISTEN/NOTIFY on the
+  EVENT_DATABASE_ALIAS database, requires psycopg2. Notifications are only
+  delivered once the transaction which sent them commits.
+"""
+import errno
+import logging
+import os
+import select
+import socket
+import tempfile
+import threading
+import uuid
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from maintenancemode.conf import settings as app_settings, setting_changed
+
+logger = logging.getLogger('maintenancemode')
+
+MESSAGE = 'changed'
+
+
+class BaseChannel(object):
+
+    # Whether messages can arrive before the change is committed: on Django<1.9, changes are
+    # announced right away, so listeners look again a second later
+    early_delivery = True
+
+    def publish(self, message):
+        """ Send ``message`` (text) to the listeners of all processes. """
+        raise NotImplementedError
+
+    def listen(self, callback, ready):
+        """
+        Call ``ready()`` once subscribed, then ``callback(message)`` for every
+        message, until ``close()``.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class InMemoryChannel(BaseChannel):
+    """ Delivers messages to the listeners of this process, in the publishing thread. """
+
+    callbacks = []
+    early_delivery = False  # the publishing thread sees its own changes
+
+    def __init__(self):
+        self.closed = threading.Event()
+
+    def publish(self, message):
+        for callback in list(self.callbacks):
+            callback(message)
+
+    def listen(self, callback, ready):
+        self.callbacks.append(callback)
+        try:
+            ready()
+            self.closed.wait()
+        finally:
+            self.callbacks.remove(callback)
+
+    def close(self):
+        self.closed.set()
+
+
+class UnixSocketChannel(BaseChannel):
+    """
+    Every listening process binds a datagram socket in EVENT_SOCKET_DIR (default:
+    a directory in the temp directory), publishing sends the message to each of
+    them. Sockets of processes which are gone are removed on the way.
+    """
+
+    def __init__(self):
+        self.directory = app_settings.EVENT_SOCKET_DIR or os.path.join(
+            tempfile.gettempdir(), 'maintenancemode-events')
+        self.closed = False
+
+    def publish(self, message):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return  # nobody listens
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.setblocking(False)
+        try:
+            for name in names:
+                if not name.endswith('.sock'):
+                    continue
+                path = os.path.join(self.directory, name)
+                try:
+                    sock.sendto(message.encode('utf-8'), path)
+                except socket.error as e:
+                    if e.errno in (errno.ECONNREFUSED, errno.ENOENT):
+                        try:
+                            os.remove(path)
+                        except OSError:
+                            pass
+                    # a full queue (EAGAIN) means that listener has a reload pending anyway
+        finally:
+            sock.close()
+
+    def listen(self, callback, ready):
+        if not os.path.isdir(self.directory):
+            try:
+                os.makedirs(self.directory)
+            except OSError:  # created by another process meanwhile
+                pass
+        path = os.path.join(self.directory, '%d-%s.sock' % (os.getpid(), uuid.uuid4().hex[:8]))
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        sock.settimeout(1)
+        sock.bind(path)
+        try:
+            ready()
+            while not self.closed:
+                try:
+                    message = sock.recv(1024)
+                except socket.timeout:
+                    continue
+                callback(message.decode('utf-8'))
+        finally:
+            sock.close()
+            os.remove(path)
+
+    def close(self):
+        self.closed = True
+
+
+class PostgresChannel(BaseChannel):
+    """ LISTEN/NOTIFY on the ``maintenancemode`` channel of the EVENT_DATABASE_ALIAS database. """
+
+    name = 'maintenancemode'
+    early_delivery = False  # NOTIFY is delivered on commit
+
+    def __init__(self):
+        self.alias = app_settings.EVENT_DATABASE_ALIAS
+        self.closed = False
+
+    def publish(self, message):
+        cursor = connections[self.alias].cursor()
+        try:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.name, message])
+        finally:
+            cursor.close()
+
+    def listen(self, callback, ready):
+        try:
+            from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+        except ImportError:
+            raise ImproperlyConfigured('PostgresChannel requires psycopg2.')
+        # A connection of its own, Django's connections belong to a thread and come and go
+        wrapper = connections[self.alias]
+        connection = wrapper.get_new_connection(wrapper.get_connection_params())
+        try:
+            connection.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+            connection.cursor().execute('LISTEN %s' % self.name)
+            ready()
+            while not self.closed:
+                if select.select([connection], [], [], 1) == ([], [], []):
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    callback(connection.notifies.pop(0).payload)
+        finally:
+            connection.close()
+
+    def close(self):
+        self.closed = True
+
+
+_channel = None
+_listener = None  # (pid, Listener)
+
+
+def get_channel():
+    """ The MAINTENANCE_MODE_EVENT_CHANNEL instance, or None. """
+    global _channel
+    if _channel is None and app_settings.EVENT_CHANNEL:
+        _channel = import_string(app_settings.EVENT_CHANNEL)()
+    return _channel
+
+
+def publish():
+    """ Tell the listeners of all processes that the maintenance state has changed. """
+    channel = get_channel()
+    if channel is None:
+        return
+    try:
+        channel.publish(MESSAGE)
+    except Exception:
+        logger.warning('Could not publish the maintenance state change', exc_info=True)
+
+
+class Listener(threading.Thread):
+    """ Reloads the snapshot of this process on every event, reconnecting on errors. """
+
+    def __init__(self, channel):
+        super(Listener, self).__init__(name='maintenancemode-events')
+        self.daemon = True
+        self.channel = channel
+        self.listening = False
+        self.stopped = False
+
+    def run(self):
+        delay = 1
+        while not self.stopped:
+            try:
+                self.channel.listen(self.on_message, self.on_ready)
+            except Exception:
+                logger.warning('Lost the maintenance state event channel, retrying in %d s', delay,
+                               exc_info=True)
+            self.listening = False
+            if self.stopped:
+                break
+            threading.Event().wait(delay)
+            delay = min(delay * 2, 60)
+
+    def on_ready(self):
+        # Events may have been missed while not listening
+        from maintenancemode import state
+        state.invalidate()
+        self.listening = True
+
+    def on_message(self, message):
+        self.reload()
+        if self.channel.early_delivery and not hasattr(transaction, 'on_commit'):  # Django<1.9
+            later = threading.Thread(target=self.reload, args=(1,))
+            later.daemon = True
+            later.start()
+
+    def reload(self, delay=0):
+        from maintenancemode import state
+        if delay:
+            threading.Event().wait(delay)
+        try:
+            state.reload()
+        finally:
+            # Close the connections opened in our own threads, not those of a publishing thread
+            if threading.current_thread() is self or delay:
+                for connection in connections.all():
+                    connection.close()
+
+    def stop(self):
+        self.stopped = True
+        self.channel.close()
+
+
+def start_listener():
+    """ Start the Listener of this process, unless it is running or there is no channel. """
+    global _listener
+    if _listener is not None and _listener[0] == os.getpid():
+        return
+    channel = get_channel()
+    if channel is None:
+        return
+    listener = Listener(channel)
+    _listener = (os.getpid(), listener)
+    listener.start()
+
+
+def is_listening():
+    """ Whether the Listener of this process is subscribed to the channel. """
+    listener = _listener
+    return listener is not None and listener[1].listening and listener[0] == os.getpid()
+
+
+def stop_listener():
+    global _listener
+    if _listener is not None:
+        _listener[1].stop()
+        _listener = None
+
+
+@receiver(setting_changed, dispatch_uid='maintenancemode.events.reset_channel')
+def _reset_channel(setting, **kwargs):
+    global _channel
+    if setting.startswith(app_settings.prefix):
+        stop_listener()
+        _channel = None
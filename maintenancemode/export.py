@@ -0,0 +1,249 @@
+"""
+Static copies of the maintenance state, for a front proxy serving maintenance
+without Python: the 503 page of every site and language, and an nginx map
+telling which requests may be passed to Django.
+
+    EXPORT_ROOT/maintenance.map
+    EXPORT_ROOT/<site host>/503.html            (LANGUAGE_CODE)
+    EXPORT_ROOT/<site host>/<language>/503.html (EXPORT_LANGUAGES)
+
+The site host is its domain without the port, like nginx's ``$host``.
+``maintenance.map`` sets ``$maintenance_pass`` to 0 for the
+"$request_method:$host:$uri" of requests which are subject to maintenance and
+not ignored, see the README. Scheduled maintenance starts and ends without a
+change of the state, so after an export_changed_state() the files are exported
+again when the next scheduled start or end comes.
+"""
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+from django.conf import settings as django_settings
+from django.contrib.sites.models import Site
+from django.db import connections
+from django.dispatch import receiver
+from django.utils import translation
+
+from maintenancemode.conf import settings as app_settings, setting_changed
+from maintenancemode.state import get_snapshot, SAFE_METHODS
+
+logger = logging.getLogger('maintenancemode')
+
+ANY_METHOD = '[A-Z]+'
+UNSAFE_METHOD = '(?!(?:%s):)[A-Z]+' % '|'.join(sorted(SAFE_METHODS))
+
+# Longest wait of the timer of the next scheduled transition, it looks again after that
+MAX_TIMER_DELAY = 24 * 3600
+
+
+def export(root):
+    """
+    Write the 503 pages and the nginx map under ``root``, return the written paths.
+    Like the pages of maintenancemode.wsgi, the pages are rendered from the
+    ``503.html`` template without a request, not by a ``handler503`` view.
+    """
+    from maintenancemode.views.defaults import cached_temporary_unavailable
+
+    snapshot = get_snapshot()
+    paths = []
+    for host, site in _by_host(Site.objects.order_by('domain'), lambda site: site.domain):
+        state = snapshot.get(site.pk)
+        for language in [None] + list(app_settings.EXPORT_LANGUAGES):
+            with translation.override(language or django_settings.LANGUAGE_CODE):
+                content = cached_temporary_unavailable(state).content
+            parts = [root, host] + ([language] if language else []) + ['503.html']
+            paths.append(_write(os.path.join(*parts), content))
+    paths.append(_write(os.path.join(root, 'maintenance.map'),
+                        nginx_map(snapshot.by_site_id.values()).encode('utf-8')))
+    return paths
+
+
+def nginx_map(states):
+    """ The nginx map of ``states``, see the module docstring. """
+    lines = [
+        '# Generated by maintenancemode.export, do not edit.',
+        'map "$request_method:$host:$uri" $maintenance_pass {',
+        '    default 1;',
+    ]
+    states = sorted((state for state in states if state.domain), key=lambda state: state.domain)
+    for host, state in _by_host(states, lambda state: state.domain):
+        host = re.escape(host)
+        for pattern in state.ignore_urls.patterns:
+            try:
+                lines.append('    %s 1;' % _regex(ANY_METHOD, host, pattern))
+            except ValueError:
+                logger.warning('Ignored URL %r of %s is left out of the nginx map: '
+                               'it has anchors the map can\'t express', pattern, state.domain)
+        if state.is_being_performed:
+            methods = UNSAFE_METHOD if state.read_only else ANY_METHOD
+            lines.append('    %s 0;' % _regex(methods, host, ''))
+        for pattern, methods in state.blocked_urls.rules:
+            methods = '|'.join(method.upper() for method in methods) if methods else ANY_METHOD
+            if not can_export(pattern):
+                logger.warning('Blocked URL %r of %s has anchors the nginx map can\'t express, '
+                               'the whole site is blocked for its methods instead', pattern, state.domain)
+                pattern = ''
+            lines.append('    %s 0;' % _regex(methods, host, pattern))
+    lines.append('}')
+    return '\n'.join(lines) + '\n'
+
+
+def _by_host(items, get_domain):
+    """
+    ``(host, item)`` of the items (sorted by domain), the host being the lowercase
+    domain without the port. Of items with the same host, only the first is kept.
+    """
+    seen = set()
+    for item in items:
+        domain = get_domain(item).lower()
+        host = domain.rsplit(':', 1)[0] if domain.rfind(':') > domain.rfind(']') else domain
+        if host in seen:
+            logger.warning('Site %s is left out of the maintenance export: '
+                           'another site has the host %s', domain, host)
+            continue
+        seen.add(host)
+        yield host, item
+
+
+def _regex(methods, host, pattern):
+    # Patterns are matched from the start of the path, like re.match() does
+    if pattern:
+        pattern = '|'.join(_unanchored_alternatives(pattern))
+    regex = '~^(?:%s):%s:%s' % (methods, host, '(?:%s)' % pattern if pattern else '')
+    # nginx unescapes \\ and \" in quoted strings
+    return '"%s"' % regex.replace('\\\\', '\\\\\\\\').replace('"', '\\"')
+
+
+def can_export(pattern):
+    """ Whether ``pattern`` can be expressed in maintenance.map. """
+    try:
+        _unanchored_alternatives(pattern)
+    except ValueError:
+        return False
+    return True
+
+
+def _unanchored_alternatives(pattern):
+    """
+    The top level alternatives of ``pattern`` without their leading ``^`` or ``\\A``.
+    In the map, the path comes after the method and host, so these anchors can't
+    match anywhere else: raise ValueError if there are others.
+    """
+    alternatives = []
+    start = depth = 0
+    in_class = False
+    i = class_start = 0
+    while i <= len(pattern):
+        char = pattern[i] if i < len(pattern) else '|'
+        if char == '\\':
+            if i + 1 == len(pattern) or pattern[i + 1] == 'A' and i != start:
+                raise ValueError(pattern)
+            i += 2
+            continue
+        if in_class:
+            # "[]" and "[^]" don't end a class
+            if char == ']' and i > class_start:
+                in_class = False
+        elif char == '[':
+            in_class = True
+            class_start = i + 2 if pattern[i + 1:i + 2] == '^' else i + 1
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif char == '^' and i != start:
+            raise ValueError(pattern)
+        elif char == '|' and depth == 0:
+            alternative = pattern[start:i]
+            if alternative.startswith('^'):
+                alternative = alternative[1:]
+            elif alternative.startswith('\\A'):
+                alternative = alternative[2:]
+            alternatives.append(alternative)
+            start = i + 1
+        i += 1
+    return alternatives
+
+
+def _write(path, content):
+    """ Replace ``path`` atomically, so that the proxy never serves a partial file. """
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, tmp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    os.chmod(tmp_path, 0o644)
+    os.rename(tmp_path, path)
+    return path
+
+
+def export_changed_state():
+    """
+    Export to MAINTENANCE_MODE_EXPORT_ROOT, if set, after a change of the maintenance
+    state, and again when the next scheduled maintenance starts or ends.
+    """
+    if app_settings.EXPORT_ROOT:
+        try:
+            export(app_settings.EXPORT_ROOT)
+        except Exception:
+            logger.exception('Could not export the maintenance state to %s', app_settings.EXPORT_ROOT)
+        schedule_export(get_snapshot().next_transition)
+
+
+def export_soon():
+    """
+    Export to MAINTENANCE_MODE_EXPORT_ROOT, if set, from a timer thread a second
+    from now, instead of on the request (or admin save) changing the state. Changes
+    within that second are exported together.
+    """
+    if app_settings.EXPORT_ROOT:
+        schedule_export(time.time())
+
+
+_timer = None
+
+
+def schedule_export(transition):
+    """ Call export_changed_state() at the timestamp ``transition``, instead of at any earlier one. """
+    global _timer
+    cancel_scheduled_export()
+    if transition == float('inf'):
+        return
+    # A second late, so that the transition has passed for the snapshot
+    delay = min(max(transition - time.time(), 0) + 1, MAX_TIMER_DELAY)
+    _timer = threading.Timer(delay, _run_scheduled_export, args=(transition,))
+    _timer.daemon = True
+    _timer.start()
+
+
+def cancel_scheduled_export():
+    global _timer
+    if _timer is not None:
+        _timer.cancel()
+        _timer = None
+
+
+def scheduled_export(transition):
+    """ Export if ``transition`` has come, or wait for it again. """
+    if time.time() < transition:
+        schedule_export(transition)
+    else:
+        export_changed_state()
+
+
+def _run_scheduled_export(transition):
+    try:
+        scheduled_export(transition)
+    finally:
+        for connection in connections.all():
+            connection.close()
+
+
+@receiver(setting_changed, dispatch_uid='maintenancemode.export.cancel_scheduled_export')
+def _cancel_scheduled_export(setting, **kwargs):
+    if setting.startswith(app_settings.prefix):
+        cancel_scheduled_export()
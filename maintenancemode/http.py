@@ -1,4 +1,27 @@
 from django.http import HttpResponse
+from django.utils.http import http_date
+
 
 class HttpResponseTemporaryUnavailable(HttpResponse):
     status_code = 503
+
+    def __init__(self, *args, **kwargs):
+        """
+        Takes the arguments of HttpResponse, and three keyword-only ones:
+        ``retry_after`` is a number of seconds or a (UTC) datetime, ``etag`` is
+        quoted if needed and ``cache_control`` is used as given.
+        """
+        retry_after = kwargs.pop('retry_after', None)
+        etag = kwargs.pop('etag', None)
+        cache_control = kwargs.pop('cache_control', None)
+        super(HttpResponseTemporaryUnavailable, self).__init__(*args, **kwargs)
+        if retry_after is not None:
+            if hasattr(retry_after, 'timetuple'):
+                from calendar import timegm
+                self['Retry-After'] = http_date(timegm(retry_after.utctimetuple()))
+            else:
+                self['Retry-After'] = str(int(retry_after))
+        if etag is not None:
+            self['ETag'] = etag if etag.startswith(('"', 'W/"')) else '"%s"' % etag
+        if cache_control is not None:
+            self['Cache-Control'] = cache_control
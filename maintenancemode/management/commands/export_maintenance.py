@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from maintenancemode.conf import settings as app_settings
+from maintenancemode.export import export
+
+
+class Command(BaseCommand):
+    args = '[directory]'
+    help = ('Writes the 503 page of every site and language, and an nginx map of the ignored URLs, '
+            'to the directory (default: MAINTENANCE_MODE_EXPORT_ROOT).')
+
+    def handle(self, *args, **options):
+        root = args[0] if args else app_settings.EXPORT_ROOT
+        if not root:
+            raise CommandError('Give a directory or set MAINTENANCE_MODE_EXPORT_ROOT.')
+        paths = export(root)
+        self.stdout.write('Wrote %d file(s) to %s.' % (len(paths), root))
@@ -0,0 +1,84 @@
+from optparse import make_option
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.core.management.base import BaseCommand, CommandError
+
+from maintenancemode import state
+from maintenancemode.backends import get_backend
+from maintenancemode.bypass import make_token
+from maintenancemode.conf import settings as app_settings
+from maintenancemode.export import cancel_scheduled_export, export_changed_state
+from maintenancemode.models import Maintenance
+
+
+class Command(BaseCommand):
+    args = 'on|off|status|token'
+    help = ('Turns maintenance mode on or off for the current site (or the given ones) '
+            'with a single UPDATE, and tells all workers to reload their state. '
+            '"token" prints a new bypass token (see maintenancemode.bypass).')
+    option_list = BaseCommand.option_list + (
+        make_option('--site', action='append', dest='sites', default=[],
+                    help='Domain or id of a site, can be repeated. Default: the SITE_ID site.'),
+        make_option('--all-sites', action='store_true', dest='all_sites', default=False,
+                    help='All sites.'),
+        make_option('--mode', dest='mode', choices=[Maintenance.FULL, Maintenance.READ_ONLY],
+                    help='With "on": full or read_only maintenance.'),
+        make_option('--label', dest='label', default='',
+                    help='With "token": a name telling the token apart, like "qa".'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1 or args[0] not in ('on', 'off', 'status', 'token'):
+            raise CommandError('Usage: manage.py maintenance on|off|status|token [--site ...] [--all-sites]')
+        if args[0] == 'token':
+            self.stdout.write('?%s=%s' % (app_settings.BYPASS_PARAM, make_token(options['label'])))
+            self.stdout.write('Valid for %d seconds.' % app_settings.BYPASS_MAX_AGE)
+            return
+        sites = self.get_sites(options['sites'], options['all_sites'])
+        Maintenance.objects.provision(sites)
+        maintenances = Maintenance.objects.filter(site__in=sites)
+
+        if args[0] == 'status':
+            for maintenance in maintenances.select_related('site').order_by('site__domain'):
+                self.stdout.write('%s: %s%s' % (
+                    maintenance.site.domain,
+                    'on (%s)' % maintenance.mode if maintenance.is_being_performed else 'off',
+                    ', scheduled %s - %s' % (maintenance.scheduled_start, maintenance.scheduled_end)
+                    if maintenance.scheduled_start else '',
+                ))
+            self.stdout.write('State generation: %s' % get_backend().get_generation())
+            return
+
+        changes = {'is_being_performed': args[0] == 'on'}
+        if args[0] == 'on' and options['mode']:
+            changes['mode'] = options['mode']
+        updated = maintenances.update(**changes)
+        # update() sends no signals, announce the change by hand
+        generation = state.state_changed()
+        if app_settings.EXPORT_ROOT:
+            # The command exits before the export in the background would run
+            cancel_scheduled_export()
+            export_changed_state()
+        self.stdout.write('Maintenance mode %s for %d site(s).' % (args[0], updated))
+        if generation is None:
+            self.stdout.write('Workers will notice within MAINTENANCE_MODE_STATE_TTL seconds.')
+        else:
+            self.stdout.write('State generation: %s' % generation)
+
+    def get_sites(self, sites, all_sites):
+        if all_sites:
+            return list(Site.objects.all())
+        if not sites:
+            site_id = getattr(settings, 'SITE_ID', None)
+            if site_id is None:
+                raise CommandError('SITE_ID is not set, use --site or --all-sites.')
+            return [Site.objects.get(pk=site_id)]
+        result = []
+        for site in sites:
+            lookup = {'pk': int(site)} if site.isdigit() else {'domain__iexact': site}
+            try:
+                result.append(Site.objects.get(**lookup))
+            except Site.DoesNotExist:
+                raise CommandError('Site %s does not exist.' % site)
+        return result
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from maintenancemode.models import Maintenance
+
+
+class Command(BaseCommand):
+    help = 'Creates the missing Maintenance records of all sites, meant to be run at deploy time.'
+
+    def handle(self, *args, **options):
+        created = Maintenance.objects.provision()
+        self.stdout.write('Created %d Maintenance record(s).' % created)
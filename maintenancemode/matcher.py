@@ -0,0 +1,218 @@
+import logging
+import re
+import sys
+
+# Python 2 refuses to compile patterns with more than 100 groups.
+_MAX_GROUPS = 99 if sys.version_info < (3, 5) else None
+_META_CHARACTERS = frozenset('.^$*+?{}[]\\|()')
+_QUANTIFIERS = frozenset('*+?{')
+_DEFAULT_FLAGS = re.compile('').flags
+# Patterns which can't be renumbered inside a bigger alternation.
+_UNMERGEABLE = re.compile(r'\\[1-9]|\(\?P[<=]')
+
+_LITERAL, _EXACT, _REGEX = 'literal', 'exact', 'regex'
+
+logger = logging.getLogger('maintenancemode')
+
+
+def split_literal_prefix(pattern):
+    r"""
+    Split ``pattern`` into the fixed text every match starts with, and the rest,
+    e.g. ``r'^/api/v\d+/'`` into ``'/api/v'`` and ``r'\d+/'``.
+    """
+    if '|' in pattern or re.compile(pattern).flags != _DEFAULT_FLAGS:
+        return '', pattern
+    i = 1 if pattern.startswith('^') else 0
+    prefix = []
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\':
+            if i + 1 >= len(pattern) or pattern[i + 1].isalnum():
+                break
+            literal, width = pattern[i + 1], 2
+        elif char in _META_CHARACTERS:
+            break
+        else:
+            literal, width = char, 1
+        if pattern[i + width:i + width + 1] in _QUANTIFIERS:
+            break  # the quantified character is not fixed
+        prefix.append(literal)
+        i += width
+    return ''.join(prefix), pattern[i:]
+
+
+class URLMatcher(object):
+    """
+    Matches paths against a set of regular expressions, like
+    ``any(re.match(pattern, path) for pattern in patterns)`` but faster.
+
+    Patterns starting with fixed text are stored in a prefix trie, so only the
+    patterns whose prefix matches the path get tried. Patterns which are plain
+    text (optionally ending with ``$``) are matched without a regex at all.
+    All other patterns are merged into a single alternation. Invalid patterns
+    are logged and left out of ``patterns``, so they never match.
+
+    Of several matching patterns, the one declared first is returned, wherever
+    it is stored: callers such as maintenancemode.ratelimit key on it.
+    """
+
+    def __init__(self, patterns):
+        valid = []
+        for pattern in patterns:
+            try:
+                valid.append((pattern, re.compile(pattern)))
+            except re.error as e:
+                logger.warning('Ignoring the invalid URL pattern %r: %s', pattern, e)
+        self.patterns = tuple(pattern for pattern, compiled in valid)
+        self._trie = ({}, [])
+        merged = []
+        for index, (pattern, compiled) in enumerate(valid):
+            prefix, rest = split_literal_prefix(pattern)
+            if not prefix:
+                merged.append((index, pattern, compiled))
+                continue
+            if not rest:
+                entry = (index, _LITERAL, pattern, prefix)
+            elif rest == '$':
+                entry = (index, _EXACT, pattern, prefix)
+            else:
+                entry = (index, _REGEX, pattern, compiled)
+            self._add_to_trie(prefix, entry)
+        self._alternations = self._merge(merged)
+
+    def _add_to_trie(self, prefix, entry):
+        node = self._trie
+        for char in prefix:
+            node = node[0].setdefault(char, ({}, []))
+        node[1].append(entry)
+
+    @staticmethod
+    def _merge(compiled_patterns):
+        """
+        Build as few alternation regexes as possible, see ``_match_alternations``.
+        They are kept in declaration order, each with the index of its first pattern.
+        """
+        alternations = []
+        chunk, groups, group_patterns = [], 0, {}
+
+        def flush():
+            if chunk:
+                first_index = min(index for index, pattern in group_patterns.values())
+                alternations.append((first_index, re.compile('|'.join(chunk)), dict(group_patterns)))
+                del chunk[:]
+                group_patterns.clear()
+
+        for index, pattern, compiled in compiled_patterns:
+            if _UNMERGEABLE.search(pattern) or compiled.flags != _DEFAULT_FLAGS:
+                flush()
+                groups = 0
+                alternations.append((index, compiled, None))
+                continue
+            if _MAX_GROUPS is not None and groups + compiled.groups + 1 > _MAX_GROUPS:
+                flush()
+                groups = 0
+            group_patterns[groups + 1] = (index, pattern)
+            chunk.append('(%s)' % pattern)
+            groups += compiled.groups + 1
+        flush()
+        return alternations
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def match(self, path):
+        """ Return the first declared pattern matching the start of ``path``, or None. """
+        best = None
+        node = self._trie
+        for char in path:
+            node = node[0].get(char)
+            if node is None:
+                break
+            for entry in node[1]:
+                index, kind, pattern, value = entry
+                if best is not None and index > best[0]:
+                    break  # entries of a node are in declaration order
+                if kind == _LITERAL:
+                    matched = True
+                elif kind == _EXACT:
+                    matched = path == value or path == value + '\n'
+                else:
+                    matched = value.match(path) is not None
+                if matched:
+                    best = (index, pattern)
+                    break
+        return self._match_alternations(path, best)
+
+    def _match_alternations(self, path, best):
+        """ The first declared of ``best`` (an ``(index, pattern)`` or None) and the merged patterns. """
+        for first_index, regex, group_patterns in self._alternations:
+            if best is not None and first_index > best[0]:
+                break
+            match = regex.match(path)
+            if match is not None:
+                # Each pattern is wrapped in its own group, which is always the
+                # last group to close when that pattern matches. In an alternation
+                # the first alternative which matches wins.
+                matched = (first_index, regex.pattern) if group_patterns is None \
+                    else group_patterns[match.lastindex]
+                if best is None or matched[0] < best[0]:
+                    best = matched
+                break
+        return best[1] if best is not None else None
+
+
+class MethodURLMatcher(object):
+    """
+    Matches ``(method, path)`` against rules of a pattern and the HTTP methods
+    it applies to (all methods if empty), using one URLMatcher per method.
+    """
+
+    def __init__(self, rules):
+        self.rules = tuple(rules)
+        by_method = {}
+        for pattern, methods in self.rules:
+            for method in methods or ('*',):
+                by_method.setdefault(method.upper(), []).append(pattern)
+        self._matchers = dict((method, URLMatcher(patterns)) for method, patterns in by_method.items())
+        self._any_method = self._matchers.pop('*', None)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def match(self, method, path):
+        """
+        Return the first pattern matching ``path`` of the rules for ``method``,
+        else of the rules for all methods, or None.
+        """
+        matcher = self._matchers.get(method)
+        if matcher is not None:
+            pattern = matcher.match(path)
+            if pattern is not None:
+                return pattern
+        if self._any_method is not None:
+            return self._any_method.match(path)
+        return None
+
+
+# The matchers of the current snapshot, by pattern set, see retain_matchers()
+_matchers = {}
+
+
+def get_matcher(patterns, matcher_class=URLMatcher):
+    """ Return a matcher for ``patterns``, reusing it while the patterns don't change. """
+    key = (matcher_class, tuple(patterns))
+    matcher = _matchers.get(key)
+    if matcher is None:
+        matcher = _matchers[key] = matcher_class(key[1])
+    return matcher
+
+
+def retain_matchers(matchers):
+    """
+    Forget the matchers other than ``matchers``, those of a new snapshot. Every
+    pattern set of the previous snapshot is reused by the next one if unchanged,
+    however many sites there are, and sets which are gone don't pile up.
+    """
+    global _matchers
+    keep = set(id(matcher) for matcher in matchers)
+    _matchers = dict((key, matcher) for key, matcher in list(_matchers.items()) if id(matcher) in keep)
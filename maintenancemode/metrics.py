@@ -0,0 +1,118 @@
+"""
+Instrumentation of the middleware's decisions.
+
+MAINTENANCE_MODE_METRICS_SINKS is a list of dotted paths to callables, which are
+called with ``(request, decision)`` for every request MaintenanceModeMiddleware
+checks. With no sinks configured, decisions aren't timed or recorded at all.
+"""
+import logging
+import threading
+
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from maintenancemode.conf import settings as app_settings, setting_changed
+from maintenancemode.signals import maintenance_decision
+
+# Decision reasons
+NOT_IN_MAINTENANCE = 'not_in_maintenance'
+INTERNAL_IP = 'internal_ip'
+ALLOWED_NETWORK = 'allowed_network'
+PERMISSION_PROCESSOR = 'permission_processor'  # detail: the processor's dotted path
+IGNORED_URL = 'ignored_url'  # detail: the pattern
+RATE_LIMITED = 'rate_limited'  # detail: the ignored URL pattern whose rate limit was exceeded
+BLOCKED = 'blocked'
+
+
+class Decision(object):
+    """ Why the middleware let a request through, or blocked it, and how long that took. """
+    __slots__ = ('reason', 'detail', 'duration', 'site_id', 'path')
+
+    def __init__(self, reason, detail, duration, site_id, path):
+        self.reason = reason
+        self.detail = detail
+        self.duration = duration
+        self.site_id = site_id
+        self.path = path
+
+    @property
+    def blocked(self):
+        return self.reason in (BLOCKED, RATE_LIMITED)
+
+    def __repr__(self):
+        return '<Decision %s %s %.3f ms>' % (self.reason, self.detail or '', self.duration * 1000)
+
+
+def send_signal(request, decision):
+    """ Sink sending the ``maintenancemode.signals.maintenance_decision`` signal. """
+    maintenance_decision.send(sender=Decision, request=request, decision=decision)
+
+
+decision_logger = logging.getLogger('maintenancemode.decisions')
+
+
+def log_decision(request, decision):
+    """ Sink logging decisions to the ``maintenancemode.decisions`` logger. """
+    decision_logger.info('%s %s %s (%.3f ms)', decision.path, decision.reason, decision.detail or '',
+                         decision.duration * 1000, extra={'decision': decision})
+
+
+class DecisionCounter(object):
+    """ Sink counting decisions by reason and detail, exportable as Prometheus text. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.counts = {}
+            self.durations = {}
+
+    def __call__(self, request, decision):
+        key = (decision.reason, decision.detail or '')
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+            self.durations[key] = self.durations.get(key, 0.0) + decision.duration
+
+    @staticmethod
+    def _labels(key):
+        def escape(value):
+            return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        return '{reason="%s",detail="%s"}' % (escape(key[0]), escape(key[1]))
+
+    def export_prometheus(self):
+        with self.lock:
+            counts, durations = dict(self.counts), dict(self.durations)
+        lines = [
+            '# HELP maintenancemode_decisions_total Requests checked by the maintenance mode middleware.',
+            '# TYPE maintenancemode_decisions_total counter',
+        ]
+        lines.extend('maintenancemode_decisions_total%s %d' % (self._labels(key), counts[key])
+                     for key in sorted(counts))
+        lines.extend([
+            '# HELP maintenancemode_decision_seconds_total Time spent checking requests.',
+            '# TYPE maintenancemode_decision_seconds_total counter',
+        ])
+        lines.extend('maintenancemode_decision_seconds_total%s %r' % (self._labels(key), durations[key])
+                     for key in sorted(durations))
+        return '\n'.join(lines) + '\n'
+
+
+counter = DecisionCounter()
+
+_sinks = None
+
+
+def get_sinks():
+    global _sinks
+    if _sinks is None:
+        _sinks = tuple(import_string(sink) for sink in app_settings.METRICS_SINKS)
+    return _sinks
+
+
+@receiver(setting_changed, dispatch_uid='maintenancemode.metrics.reset_sinks')
+def _reset_sinks(setting, **kwargs):
+    global _sinks
+    if setting.startswith(app_settings.prefix):
+        _sinks = None
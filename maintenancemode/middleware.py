@@ -1,66 +1,137 @@
-import re
-
-from django.conf import settings as django_settings
-from django.db.utils import DatabaseError
-from django.core import urlresolvers
-from django.utils.module_loading import import_string
-from django.contrib.sites.models import Site
-import django.conf.urls as urls
-
-from maintenancemode.models import Maintenance, IgnoredURL
-from maintenancemode.conf import settings as app_settings
-
-urls.handler503 = 'maintenancemode.views.defaults.temporary_unavailable'
-urls.__all__.append('handler503')
-
-
-class MaintenanceModeMiddleware(object):
-    def process_request(self, request):
-        """
-        Get the maintenance mode from the database.
-        If a Maintenance value doesn't already exist in the database, we'll create one.
-        "has_add_permission" and "has_delete_permission" are overridden in admin
-        to prevent the user from adding or deleting a record, as we only need one
-        to affect multiple sites managed from one instance of Django admin.
-        """
-        site = Site.objects.get_current()
-        maintenance = None
-
-        try:
-            maintenance = Maintenance.objects.get(site=site)
-        except (Maintenance.DoesNotExist, DatabaseError):
-            for site in Site.objects.all():
-                maintenance = Maintenance.objects.create(site=site, is_being_performed=False)
-
-        # Allow access if maintenance is not being performed
-        if not maintenance.is_being_performed:
-            return None
-
-        # Allow access if remote ip is in INTERNAL_IPS
-        if request.META.get('REMOTE_ADDR') in django_settings.INTERNAL_IPS:
-            return None
-
-        # Cycle trough PERMISSION_PROCESSORS to see if this user has the right to access the site
-        for processor in self._permission_processors():
-            if processor(request):
-                return None
-
-        # Check if a path is explicitly excluded from maintenance mode
-        urls_to_ignore = IgnoredURL.objects.filter(maintenance=maintenance)
-        ignore_urls = tuple([re.compile(r'%s' % str(url.pattern)) for url in urls_to_ignore])
-        for url in ignore_urls:
-            if url.match(request.path_info):
-                return None
-
-        # Otherwise show the user the 503 page
-        resolver = urlresolvers.get_resolver(None)
-
-        if hasattr(resolver, 'resolve_error_handler'):
-            callback, param_dict = resolver.resolve_error_handler('503')
-        else:  # Django<1.8
-            callback, param_dict = resolver._resolve_special('503')
-        return callback(request, **param_dict)
-
-    def _permission_processors(self):
-        for processor_module in app_settings.PERMISSION_PROCESSORS:
-            yield import_string(processor_module)
+import time
+
+from django.conf import settings as django_settings
+from django.dispatch import receiver
+
+from maintenancemode import bypass, metrics, ramp, ratelimit
+from maintenancemode.conf import setting_changed
+from maintenancemode.networks import is_allowed_address
+from maintenancemode.registry import get_permission_context, permission_processors
+from maintenancemode.routers import set_read_only
+from maintenancemode.state import get_current_state, SAFE_METHODS
+
+DEFAULT_HANDLER503 = 'maintenancemode.views.defaults.temporary_unavailable'
+
+_handler503 = None
+
+
+def get_handler503():
+    """
+    The ``(view, kwargs)`` of the handler503 of the ROOT_URLCONF, or of the default
+    view if it has none. Resolved on first use, and cached until ROOT_URLCONF changes.
+    """
+    global _handler503
+    if _handler503 is None:
+        from django.core import urlresolvers
+        urlconf_module = urlresolvers.get_resolver(None).urlconf_module
+        handler = getattr(urlconf_module, 'handler503', None) or DEFAULT_HANDLER503
+        _handler503 = urlresolvers.get_callable(handler), {}
+    return _handler503
+
+
+@receiver(setting_changed, dispatch_uid='maintenancemode.middleware.reset_handler503')
+def _reset_handler503(setting, **kwargs):
+    global _handler503
+    if setting == 'ROOT_URLCONF':
+        _handler503 = None
+
+
+class MaintenanceModeMiddleware(object):
+    """
+    Works both in MIDDLEWARE_CLASSES and in new-style MIDDLEWARE (Django>=1.10),
+    where it is called with ``get_response``.
+    """
+
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+        permission_processors.build()
+
+    def __call__(self, request):
+        try:
+            response = self.process_request(request)
+            if response is None:
+                response = self.get_response(request)
+            return self.process_response(request, response)
+        finally:
+            set_read_only(False)
+
+    def process_request(self, request):
+        """
+        Get the maintenance mode from the cached state (see maintenancemode.state).
+        If a Maintenance value doesn't already exist in the database, we'll create one.
+        "has_add_permission" and "has_delete_permission" are overridden in admin
+        to prevent the user from adding or deleting a record, as we only need one
+        to affect multiple sites managed from one instance of Django admin.
+        """
+        state = get_current_state(request)
+        # Reads of requests served during read-only maintenance may go to a replica
+        set_read_only(state.read_only and request.method in SAFE_METHODS)
+
+        sinks = metrics.get_sinks()
+        if not sinks:
+            reason = self.check(request, state)
+        else:
+            start = time.time()
+            details = []
+            reason = self.check(request, state, details)
+            decision = metrics.Decision(reason, details[0] if details else None,
+                                        time.time() - start, state.site_id, request.path_info)
+            for sink in sinks:
+                sink(request, decision)
+
+        if reason == metrics.RATE_LIMITED:
+            from maintenancemode.views.defaults import cached_temporary_unavailable
+            pattern = state.ignore_urls.match(request.path_info)
+            return cached_temporary_unavailable(state, retry_after=ratelimit.retry_after(state, pattern))
+        if reason != metrics.BLOCKED:
+            return None
+
+        # Otherwise show the user the 503 page
+        callback, param_dict = get_handler503()
+        return callback(request, **param_dict)
+
+    def process_response(self, request, response):
+        set_read_only(False)
+        return ramp.set_cookie(request, bypass.set_cookie(request, response))
+
+    def process_exception(self, request, exception):
+        set_read_only(False)
+
+    def check(self, request, state, details=None):
+        """
+        Return the reason (see maintenancemode.metrics) why ``request`` is
+        let through, or metrics.BLOCKED. The name of the processor or pattern
+        which let the request through is appended to ``details``, if given.
+        """
+
+        # Allow access if maintenance is not being performed, neither on the whole site
+        # (or not yet for this client while ramping) nor on the requested path (BlockedURL)
+        bucket = ramp.get_bucket(request) if state.ramp is not None else None
+        if not state.blocks(request.method, request.path_info, bucket):
+            return metrics.NOT_IN_MAINTENANCE
+
+        # Allow access if remote ip is in INTERNAL_IPS
+        if request.META.get('REMOTE_ADDR') in django_settings.INTERNAL_IPS:
+            return metrics.INTERNAL_IP
+
+        # Allow access if the client is in MAINTENANCE_MODE_ALLOWED_NETWORKS
+        if is_allowed_address(request.META):
+            return metrics.ALLOWED_NETWORK
+
+        # Cycle trough PERMISSION_PROCESSORS to see if this user has the right to access the site
+        name = get_permission_context(request).granted_by()
+        if name is not None:
+            if details is not None:
+                details.append(name)
+            return metrics.PERMISSION_PROCESSOR
+
+        # Check if a path is explicitly excluded from maintenance mode, and within its rate limit
+        pattern = state.ignore_urls.match(request.path_info)
+        if pattern is not None:
+            if details is not None:
+                details.append(pattern)
+            if request.META.get(ratelimit.ADMITTED_KEY) != pattern and not ratelimit.admit(state, pattern):
+                return metrics.RATE_LIMITED
+            return metrics.IGNORED_URL
+
+        return metrics.BLOCKED
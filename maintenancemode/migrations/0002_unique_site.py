@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def remove_duplicates(apps, schema_editor):
+    """ Keep the oldest Maintenance record of each site, moving ignored URLs over to it. """
+    Maintenance = apps.get_model('maintenancemode', 'Maintenance')
+    IgnoredURL = apps.get_model('maintenancemode', 'IgnoredURL')
+    kept = {}
+    for maintenance in Maintenance.objects.order_by('pk'):
+        if maintenance.site_id not in kept:
+            kept[maintenance.site_id] = maintenance
+            continue
+        IgnoredURL.objects.filter(maintenance=maintenance).update(
+            maintenance=kept[maintenance.site_id],
+        )
+        maintenance.delete()
+
+
+def noop(apps, schema_editor):
+    # RunPython.noop is only available on Django>=1.8
+    pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maintenancemode', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicates, noop),
+        migrations.AlterField(
+            model_name='maintenance',
+            name='site',
+            field=models.OneToOneField(to='sites.Site'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maintenancemode', '0002_unique_site'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='maintenance',
+            name='recurrence',
+            field=models.CharField(default=b'', max_length=10, blank=True, choices=[(b'', b'Once'), (b'daily', b'Daily'), (b'weekly', b'Weekly')]),
+        ),
+        migrations.AddField(
+            model_name='maintenance',
+            name='scheduled_end',
+            field=models.DateTimeField(null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='maintenance',
+            name='scheduled_start',
+            field=models.DateTimeField(null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='maintenance',
+            name='timezone',
+            field=models.CharField(help_text=b'Time zone of recurring windows, e.g. Europe/Zagreb. Defaults to TIME_ZONE.', max_length=63, blank=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maintenancemode', '0003_schedule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BlockedURL',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('pattern', models.CharField(max_length=255)),
+                ('methods', models.CharField(help_text=b'Comma separated HTTP methods, e.g. POST,PUT. Leave empty to block all methods.', max_length=100, blank=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('description', models.CharField(help_text=b'What this URL pattern covers.', max_length=75)),
+                ('maintenance', models.ForeignKey(to='maintenancemode.Maintenance')),
+            ],
+            options={
+                'verbose_name': 'blocked URL',
+            },
+        ),
+    ]
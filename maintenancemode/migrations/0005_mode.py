@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maintenancemode', '0004_blockedurl'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='maintenance',
+            name='mode',
+            field=models.CharField(default=b'full', max_length=10, choices=[(b'full', b'Full: block all requests'), (b'read_only', b'Read-only: block POST, PUT, PATCH and DELETE requests')]),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.core.validators
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maintenancemode', '0005_mode'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='maintenance',
+            name='ramp_end',
+            field=models.DateTimeField(null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='maintenance',
+            name='ramp_from',
+            field=models.PositiveSmallIntegerField(default=0, help_text=b'Percentage of clients getting the maintenance page at the start of the ramp.', validators=[django.core.validators.MaxValueValidator(100)]),
+        ),
+        migrations.AddField(
+            model_name='maintenance',
+            name='ramp_start',
+            field=models.DateTimeField(null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='maintenance',
+            name='ramp_to',
+            field=models.PositiveSmallIntegerField(default=100, help_text=b'Percentage of clients getting the maintenance page from the end of the ramp on.', validators=[django.core.validators.MaxValueValidator(100)]),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maintenancemode', '0006_ramp'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ignoredurl',
+            name='burst',
+            field=models.PositiveIntegerField(help_text=b'Requests let through at once after a quiet period. Defaults to the rate limit.', null=True, blank=True),
+        ),
+        migrations.AddField(
+            model_name='ignoredurl',
+            name='rate_limit',
+            field=models.PositiveIntegerField(help_text=b'Requests per minute let through during maintenance, the others get the maintenance page. Leave empty for no limit.', null=True, blank=True),
+        ),
+    ]
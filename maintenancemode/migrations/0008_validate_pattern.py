@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import maintenancemode.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('maintenancemode', '0007_ignoredurl_rate_limit'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='blockedurl',
+            name='pattern',
+            field=models.CharField(max_length=255, validators=[maintenancemode.models.validate_pattern]),
+        ),
+        migrations.AlterField(
+            model_name='ignoredurl',
+            name='pattern',
+            field=models.CharField(max_length=255, validators=[maintenancemode.models.validate_pattern]),
+        ),
+    ]
@@ -1,21 +1,164 @@
-from django.contrib.sites.models import Site
-from django.db import models
-
-
-class Maintenance(models.Model):
-    site = models.ForeignKey(Site)
-    is_being_performed = models.BooleanField('In Maintenance Mode', default=False)
-
-    class Meta:
-        verbose_name = verbose_name_plural = 'Maintenance Mode'
-
-    def __unicode__(self):
-        return self.site.domain
-
-class IgnoredURL(models.Model):
-    maintenance = models.ForeignKey(Maintenance)
-    pattern = models.CharField(max_length=255)
-    description = models.CharField(max_length=75, help_text='What this URL pattern covers.')
-
-    def __unicode__(self):
-        return self.pattern
+import re
+
+from django.contrib.sites.models import Site
+from django.core.exceptions import ValidationError
+from django.core.validators import MaxValueValidator
+from django.db import models, transaction, IntegrityError
+
+from maintenancemode import schedule
+from maintenancemode.conf import settings as app_settings
+
+
+class MaintenanceManager(models.Manager):
+
+    def provision(self, sites=None):
+        """
+        Create the missing Maintenance records for ``sites`` (default: all sites)
+        with a single INSERT. Safe to call concurrently from several processes.
+        Returns the number of records created.
+        """
+        if sites is None:
+            site_ids = set(Site.objects.values_list('pk', flat=True))
+        else:
+            site_ids = set(site.pk for site in sites)
+        for attempt in range(2):
+            existing = set(self.filter(site__in=site_ids).values_list('site_id', flat=True))
+            missing = [self.model(site_id=site_id, is_being_performed=False)
+                       for site_id in sorted(site_ids - existing)]
+            if not missing:
+                return 0
+            try:
+                with transaction.atomic(using=self.db):
+                    self.bulk_create(missing)
+                return len(missing)
+            except IntegrityError:
+                # Another process created some of them in the meantime, try again with the rest
+                continue
+        return 0
+
+
+class Maintenance(models.Model):
+    FULL, READ_ONLY = 'full', 'read_only'
+    MODE_CHOICES = (
+        (FULL, 'Full: block all requests'),
+        (READ_ONLY, 'Read-only: block POST, PUT, PATCH and DELETE requests'),
+    )
+
+    site = models.OneToOneField(Site)
+    is_being_performed = models.BooleanField('In Maintenance Mode', default=False)
+    mode = models.CharField(max_length=10, choices=MODE_CHOICES, default=FULL)
+    scheduled_start = models.DateTimeField(null=True, blank=True)
+    scheduled_end = models.DateTimeField(null=True, blank=True)
+    recurrence = models.CharField(max_length=10, blank=True, choices=schedule.RECURRENCE_CHOICES,
+                                  default=schedule.ONCE)
+    timezone = models.CharField(max_length=63, blank=True,
+                                help_text='Time zone of recurring windows, e.g. Europe/Zagreb. '
+                                          'Defaults to TIME_ZONE.')
+    ramp_start = models.DateTimeField(null=True, blank=True)
+    ramp_end = models.DateTimeField(null=True, blank=True)
+    ramp_from = models.PositiveSmallIntegerField(
+        default=0, validators=[MaxValueValidator(100)],
+        help_text='Percentage of clients getting the maintenance page at the start of the ramp.')
+    ramp_to = models.PositiveSmallIntegerField(
+        default=100, validators=[MaxValueValidator(100)],
+        help_text='Percentage of clients getting the maintenance page from the end of the ramp on.')
+
+    objects = MaintenanceManager()
+
+    class Meta:
+        verbose_name = verbose_name_plural = 'Maintenance Mode'
+
+    def __unicode__(self):
+        return self.site.domain
+
+    def clean(self):
+        if (self.ramp_start is None) != (self.ramp_end is None):
+            raise ValidationError('Set both the start and the end of the ramp.')
+        if self.ramp_start is not None and self.ramp_end <= self.ramp_start:
+            raise ValidationError('The ramp must end after it starts.')
+        if (self.scheduled_start is None) != (self.scheduled_end is None):
+            raise ValidationError('Set both the start and the end of the scheduled maintenance.')
+        if self.scheduled_start is None:
+            return
+        if self.scheduled_end <= self.scheduled_start:
+            raise ValidationError('Scheduled maintenance must end after it starts.')
+        period = schedule.PERIODS.get(self.recurrence)
+        if period is not None and self.scheduled_end - self.scheduled_start >= period:
+            raise ValidationError('A recurring maintenance must be shorter than its period.')
+        try:
+            schedule.get_timezone(self.timezone)
+        except Exception as e:
+            raise ValidationError('Unknown time zone: %s' % e)
+
+    def get_schedule(self):
+        """ The scheduled maintenance window(s), or None. """
+        if self.scheduled_start is None or self.scheduled_end is None:
+            return None
+        return schedule.Schedule(self.scheduled_start, self.scheduled_end, self.recurrence,
+                                 schedule.get_timezone(self.timezone))
+
+    def get_ramp(self):
+        """ ``(start, end, from percentage, to percentage)`` with timestamps, or None. """
+        if self.ramp_start is None or self.ramp_end is None:
+            return None
+        return (schedule.to_timestamp(self.ramp_start), schedule.to_timestamp(self.ramp_end),
+                self.ramp_from, self.ramp_to)
+
+
+def validate_pattern(value):
+    from maintenancemode.export import can_export
+    try:
+        re.compile(value)
+    except re.error as e:
+        raise ValidationError('Invalid regular expression: %s' % e)
+    if app_settings.EXPORT_ROOT and not can_export(value):
+        raise ValidationError('The nginx map of MAINTENANCE_MODE_EXPORT_ROOT can only express '
+                              '^ at the start of the pattern or of its top level alternatives.')
+
+
+class IgnoredURL(models.Model):
+    maintenance = models.ForeignKey(Maintenance)
+    pattern = models.CharField(max_length=255, validators=[validate_pattern])
+    description = models.CharField(max_length=75, help_text='What this URL pattern covers.')
+    rate_limit = models.PositiveIntegerField(
+        null=True, blank=True,
+        help_text='Requests per minute let through during maintenance, the others get the '
+                  'maintenance page. Leave empty for no limit.')
+    burst = models.PositiveIntegerField(
+        null=True, blank=True,
+        help_text='Requests let through at once after a quiet period. Defaults to the rate limit.')
+
+    def __unicode__(self):
+        return self.pattern
+
+
+class BlockedURL(models.Model):
+    """ A path taken down even when the whole site isn't in maintenance. """
+    maintenance = models.ForeignKey(Maintenance)
+    pattern = models.CharField(max_length=255, validators=[validate_pattern])
+    methods = models.CharField(max_length=100, blank=True,
+                               help_text='Comma separated HTTP methods, e.g. POST,PUT. '
+                                         'Leave empty to block all methods.')
+    is_active = models.BooleanField(default=True)
+    description = models.CharField(max_length=75, help_text='What this URL pattern covers.')
+
+    class Meta:
+        verbose_name = 'blocked URL'
+
+    def __unicode__(self):
+        return self.pattern
+
+    def get_methods(self):
+        return parse_methods(self.methods)
+
+
+def parse_methods(methods):
+    """ 'post, put' => ('POST', 'PUT') """
+    return tuple(method.strip().upper() for method in methods.split(',') if method.strip())
+
+
+def get_rate_limit(rate_limit, burst):
+    """ ``(requests per second, bucket capacity)`` of an IgnoredURL, or None. """
+    if not rate_limit:
+        return None
+    return rate_limit / 60.0, burst or rate_limit
@@ -0,0 +1,111 @@
+import binascii
+import bisect
+import socket
+
+from django.dispatch import receiver
+
+from maintenancemode.conf import settings as app_settings, setting_changed
+
+_IPV4_MAPPED_PREFIX = b'\x00' * 10 + b'\xff\xff'
+
+
+def parse_address(address):
+    """ Return ``(family, integer value)`` for an IPv4 or IPv6 address string. """
+    address = str(address).strip()
+    family = socket.AF_INET6 if ':' in address else socket.AF_INET
+    packed = socket.inet_pton(family, address.split('%', 1)[0])
+    if family == socket.AF_INET6 and packed.startswith(_IPV4_MAPPED_PREFIX):
+        family, packed = socket.AF_INET, packed[12:]
+    return family, int(binascii.hexlify(packed), 16)
+
+
+def parse_network(network):
+    """ Return ``(family, first address, last address)`` for a network like '10.0.0.0/8'. """
+    address, _, prefix_length = str(network).partition('/')
+    family, value = parse_address(address)
+    bits = 32 if family == socket.AF_INET else 128
+    host_bits = bits - int(prefix_length) if prefix_length else 0
+    if not 0 <= host_bits <= bits:
+        raise ValueError('Invalid network %r' % network)
+    first = value >> host_bits << host_bits
+    return family, first, first | ((1 << host_bits) - 1)
+
+
+class NetworkSet(object):
+    """
+    A set of IPv4/IPv6 networks, supporting ``address in network_set``.
+
+    Overlapping networks are merged into sorted, disjoint ranges, so a
+    lookup is a binary search whatever the number of networks.
+    """
+
+    def __init__(self, networks):
+        ranges = {}
+        for network in networks:
+            family, first, last = parse_network(network)
+            ranges.setdefault(family, []).append((first, last))
+        self._firsts, self._lasts = {}, {}
+        for family, family_ranges in ranges.items():
+            firsts, lasts = [], []
+            for first, last in sorted(family_ranges):
+                if lasts and first <= lasts[-1] + 1:
+                    lasts[-1] = max(lasts[-1], last)
+                else:
+                    firsts.append(first)
+                    lasts.append(last)
+            self._firsts[family], self._lasts[family] = firsts, lasts
+
+    def __len__(self):
+        return sum(len(firsts) for firsts in self._firsts.values())
+
+    def __contains__(self, address):
+        try:
+            family, value = parse_address(address)
+        except (socket.error, ValueError, UnicodeError):
+            return False
+        firsts = self._firsts.get(family)
+        if not firsts:
+            return False
+        i = bisect.bisect_right(firsts, value) - 1
+        return i >= 0 and value <= self._lasts[family][i]
+
+
+_allowed_networks = None
+_trusted_proxies = None
+
+
+def _compile():
+    global _allowed_networks, _trusted_proxies
+    _allowed_networks = NetworkSet(app_settings.ALLOWED_NETWORKS)
+    _trusted_proxies = NetworkSet(app_settings.TRUSTED_PROXIES)
+
+
+def get_client_address(meta):
+    """
+    The address of the client: REMOTE_ADDR, or, when the request came through
+    TRUSTED_PROXIES, the last X-Forwarded-For hop which is not a trusted proxy.
+    """
+    if _trusted_proxies is None:
+        _compile()
+    address = meta.get('REMOTE_ADDR', '')
+    forwarded_for = meta.get('HTTP_X_FORWARDED_FOR')
+    if forwarded_for and _trusted_proxies and address in _trusted_proxies:
+        for hop in reversed(forwarded_for.split(',')):
+            address = hop.strip()
+            if address not in _trusted_proxies:
+                break
+    return address
+
+
+def is_allowed_address(meta):
+    """ Whether the client of a request (given its META) is in ALLOWED_NETWORKS. """
+    if _allowed_networks is None:
+        _compile()
+    return bool(_allowed_networks) and get_client_address(meta) in _allowed_networks
+
+
+@receiver(setting_changed, dispatch_uid='maintenancemode.networks.recompile')
+def _recompile(setting, **kwargs):
+    global _allowed_networks, _trusted_proxies
+    if setting.startswith(app_settings.prefix):
+        _allowed_networks = _trusted_proxies = None
@@ -1,8 +1,26 @@
+"""
+Permission processors are called with the request and return True to let it
+through maintenance. Optional attributes help the middleware call as few of them
+as possible: ``cost``, processors are called cheapest first (default:
+maintenancemode.registry.DEFAULT_COST), and ``requires_user``, processors which
+only look at ``request.user`` are skipped for requests without a session cookie.
+"""
 
 
 def is_staff(request):
     return hasattr(request, 'user') and request.user.is_staff
+is_staff.cost = 10
+is_staff.requires_user = True
 
 
 def is_superuser(request):
     return hasattr(request, 'user') and request.user.is_superuser
+is_superuser.cost = 10
+is_superuser.requires_user = True
+
+
+def has_bypass_token(request):
+    """ A valid token of maintenancemode.bypass, checked without the database. """
+    from maintenancemode.bypass import has_valid_token
+    return has_valid_token(request)
+has_bypass_token.cost = 1
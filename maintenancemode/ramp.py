@@ -0,0 +1,58 @@
+"""
+Buckets of clients for gradual maintenance (see Maintenance.ramp_start): every
+client falls in one of 100 buckets, and while the ramp is at N percent, the
+clients of buckets 0 to N-1 get the maintenance page.
+
+A client's bucket is the CRC32 of its address, kept in the RAMP_COOKIE cookie
+so that it doesn't change with the address. The cookie is signed with
+SECRET_KEY like the tokens of maintenancemode.bypass: otherwise a client could
+pick a bucket which stays out of a descending ramp, or one which ends below
+100%, for as long as it lasts.
+"""
+import zlib
+
+from django.core import signing
+
+from maintenancemode.conf import settings as app_settings
+from maintenancemode.networks import get_client_address
+
+BUCKETS = 100
+SALT = 'maintenancemode.ramp'
+
+
+def get_bucket_from(cookies, meta):
+    """ The bucket of the client, from its ``cookies`` or the address in ``meta``. """
+    value = cookies.get(app_settings.RAMP_COOKIE)
+    if value:
+        try:
+            value = signing.Signer(salt=SALT).unsign(value)
+        except signing.BadSignature:
+            value = ''
+        if value.isdigit() and int(value) < BUCKETS:
+            return int(value)
+    address = get_client_address(meta).encode('utf-8')
+    return (zlib.crc32(address) & 0xffffffff) % BUCKETS
+
+
+def get_bucket(request):
+    """ The bucket of the client of ``request``, kept on the request for set_cookie(). """
+    bucket = getattr(request, '_maintenancemode_bucket', None)
+    if bucket is None:
+        bucket = request._maintenancemode_bucket = get_bucket_from(request.COOKIES, request.META)
+    return bucket
+
+
+def make_cookie_value(bucket):
+    """ The signed RAMP_COOKIE value of ``bucket``. """
+    return signing.Signer(salt=SALT).sign(str(bucket))
+
+
+def set_cookie(request, response):
+    """ Keep the bucket of the client of ``request``, if it was needed, in a cookie. """
+    bucket = getattr(request, '_maintenancemode_bucket', None)
+    if bucket is not None:
+        value = make_cookie_value(bucket)
+        if request.COOKIES.get(app_settings.RAMP_COOKIE) != value:
+            response.set_cookie(app_settings.RAMP_COOKIE, value,
+                                max_age=app_settings.RAMP_COOKIE_MAX_AGE, httponly=True)
+    return response
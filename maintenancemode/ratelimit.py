@@ -0,0 +1,92 @@
+"""
+Rate limits of ignored URLs (IgnoredURL.rate_limit) during maintenance.
+
+By default every process keeps a token bucket per pattern: it holds up to
+``burst`` requests and refills at ``rate_limit`` requests per minute. With
+MAINTENANCE_MODE_RATE_LIMIT_CACHE_ALIAS set, the limit is shared by all
+processes through that cache instead, counting requests in windows of
+``burst / rate_limit`` minutes.
+"""
+import hashlib
+import math
+import threading
+import time
+
+from django.core.cache import caches
+from django.dispatch import receiver
+
+from maintenancemode.conf import settings as app_settings, setting_changed
+
+# WSGI environ key set by maintenancemode.wsgi for requests it already admitted
+ADMITTED_KEY = 'maintenancemode.admitted_pattern'
+
+
+class LocalRateLimiter(object):
+    """ Token buckets in process memory. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = {}
+
+    def acquire(self, key, rate, capacity):
+        """ Take a token from the bucket ``key``, return False if it is empty. """
+        now = time.time()
+        with self.lock:
+            tokens, updated = self.buckets.get((key, rate, capacity), (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            self.buckets[(key, rate, capacity)] = (tokens - 1 if allowed else tokens, now)
+        return allowed
+
+
+class CacheRateLimiter(object):
+    """ Fixed windows of ``capacity`` requests counted in a shared cache. """
+
+    def __init__(self, alias):
+        self.cache = caches[alias]
+
+    def acquire(self, key, rate, capacity):
+        window = capacity / float(rate)
+        digest = hashlib.md5(repr(key).encode('utf-8')).hexdigest()
+        cache_key = 'maintenancemode:ratelimit:%s:%d' % (digest, time.time() // window)
+        self.cache.add(cache_key, 0, timeout=int(window) + 1)
+        try:
+            return self.cache.incr(cache_key) <= capacity
+        except ValueError:  # evicted in the meantime
+            return True
+
+
+_limiter = None
+
+
+def get_limiter():
+    global _limiter
+    if _limiter is None:
+        alias = app_settings.RATE_LIMIT_CACHE_ALIAS
+        _limiter = CacheRateLimiter(alias) if alias else LocalRateLimiter()
+    return _limiter
+
+
+def admit(state, pattern):
+    """
+    Whether a request matching the ignored URL ``pattern`` of ``state`` is
+    within the pattern's rate limit (always, for patterns without one).
+    """
+    limit = state.rate_limits.get(pattern)
+    if limit is None:
+        return True
+    rate, capacity = limit
+    return get_limiter().acquire((state.site_id, pattern), rate, capacity)
+
+
+def retry_after(state, pattern):
+    """ Seconds until a request matching ``pattern`` may be admitted again. """
+    rate, capacity = state.rate_limits[pattern]
+    return int(math.ceil(1 / rate))
+
+
+@receiver(setting_changed, dispatch_uid='maintenancemode.ratelimit.reset_limiter')
+def _reset_limiter(setting, **kwargs):
+    global _limiter
+    if setting.startswith(app_settings.prefix):
+        _limiter = None
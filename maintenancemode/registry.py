@@ -0,0 +1,135 @@
+import logging
+import time
+
+from django.conf import settings as django_settings
+from django.dispatch import receiver
+from django.utils.functional import LazyObject, empty
+from django.utils.module_loading import import_string
+
+from maintenancemode.conf import settings as app_settings, setting_changed
+
+logger = logging.getLogger('maintenancemode')
+
+
+# Cost of processors without a ``cost`` attribute, they are called after the cheaper ones
+DEFAULT_COST = 100
+
+
+class PermissionProcessorRegistry(object):
+    """
+    PERMISSION_PROCESSORS, imported once and sorted by their ``cost`` attribute,
+    cheapest first. Processors with a true ``requires_user`` attribute are in
+    ``user_processors``.
+
+    With PROCESSOR_TIMING enabled, every processor call is timed: the totals are
+    kept in ``timings`` and calls slower than SLOW_PROCESSOR_THRESHOLD are logged.
+    """
+
+    def __init__(self):
+        self.processors = None
+        self.named_processors = None
+        self.user_processors = frozenset()
+        self.timings = {}
+
+    def build(self):
+        imported = [(name, import_string(name)) for name in app_settings.PERMISSION_PROCESSORS]
+        # sorted() is stable, processors of the same cost keep their configured order
+        imported.sort(key=lambda item: getattr(item[1], 'cost', DEFAULT_COST))
+        self.user_processors = frozenset(
+            name for name, processor in imported if getattr(processor, 'requires_user', False))
+        if app_settings.PROCESSOR_TIMING:
+            imported = [(name, self._timed(name, processor)) for name, processor in imported]
+        self.named_processors = tuple(imported)
+        self.processors = tuple(processor for name, processor in imported)
+        self.timings = {}
+
+    def _timed(self, name, processor):
+        threshold = app_settings.SLOW_PROCESSOR_THRESHOLD
+
+        def timed_processor(request):
+            start = time.time()
+            try:
+                return processor(request)
+            finally:
+                duration = time.time() - start
+                calls, total = self.timings.get(name, (0, 0.0))
+                self.timings[name] = (calls + 1, total + duration)
+                if duration > threshold:
+                    logger.warning('Slow maintenance mode permission processor %s: %.1f ms',
+                                   name, duration * 1000)
+        return timed_processor
+
+    def __iter__(self):
+        if self.processors is None:
+            self.build()
+        return iter(self.processors)
+
+    def items(self):
+        """ (dotted path, processor) pairs. """
+        if self.processors is None:
+            self.build()
+        return self.named_processors
+
+
+permission_processors = PermissionProcessorRegistry()
+
+
+def has_user(request):
+    """
+    Whether ``request`` may have an authenticated user: it has a session cookie,
+    or its user was already loaded (or set) by someone else.
+    """
+    if django_settings.SESSION_COOKIE_NAME in request.COOKIES:
+        return True
+    user = getattr(request, 'user', None)
+    if user is None:
+        return False
+    return not isinstance(user, LazyObject) or user._wrapped is not empty
+
+
+class PermissionContext(object):
+    """
+    The permission processor results of one request. Every processor is called
+    at most once, and processors which require a user are skipped for requests
+    which can't have one, so that the session and user are never loaded for them.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.results = {}
+        self._has_user = None
+
+    def granted_by(self):
+        """ The name of the first processor (cheapest first) granting access, or None. """
+        for name, processor in permission_processors.items():
+            result = self.results.get(name)
+            if result is None:
+                if name in permission_processors.user_processors and not self.has_user():
+                    result = False
+                else:
+                    result = bool(processor(self.request))
+                self.results[name] = result
+            if result:
+                return name
+        return None
+
+    def has_user(self):
+        if self._has_user is None:
+            self._has_user = has_user(self.request)
+        return self._has_user
+
+
+def get_permission_context(request):
+    """ The PermissionContext of ``request``, created on first use. """
+    context = getattr(request, '_maintenancemode_permissions', None)
+    if context is None:
+        context = request._maintenancemode_permissions = PermissionContext(request)
+    return context
+
+
+@receiver(setting_changed, dispatch_uid='maintenancemode.registry.rebuild_processors')
+def _rebuild_processors(setting, **kwargs):
+    if setting.startswith(app_settings.prefix) and permission_processors.processors is not None:
+        # conf.settings may not have seen the change yet
+        app_settings.reload()
+        permission_processors.build()
@@ -0,0 +1,23 @@
+import threading
+
+from maintenancemode.conf import settings as app_settings
+
+_local = threading.local()
+
+
+def set_read_only(read_only):
+    """ Called by the middleware for every request, see ReadOnlyMaintenanceRouter. """
+    _local.read_only = read_only
+
+
+class ReadOnlyMaintenanceRouter(object):
+    """
+    Sends the ORM reads of requests served during read-only maintenance to the
+    MAINTENANCE_MODE_READ_ONLY_DATABASE database, e.g. a replica, while the
+    default database is being migrated. Add it to DATABASE_ROUTERS to use it.
+    """
+
+    def db_for_read(self, model, **hints):
+        if getattr(_local, 'read_only', False) and model._meta.app_label != 'maintenancemode':
+            return app_settings.READ_ONLY_DATABASE
+        return None
@@ -0,0 +1,84 @@
+import calendar
+import time
+from datetime import timedelta
+
+from django.utils import timezone
+
+try:
+    import pytz
+except ImportError:
+    pytz = None
+
+ONCE, DAILY, WEEKLY = '', 'daily', 'weekly'
+RECURRENCE_CHOICES = (
+    (ONCE, 'Once'),
+    (DAILY, 'Daily'),
+    (WEEKLY, 'Weekly'),
+)
+PERIODS = {
+    DAILY: timedelta(days=1),
+    WEEKLY: timedelta(days=7),
+}
+
+
+def get_timezone(name):
+    """ The tzinfo called ``name``, or the default time zone if ``name`` is empty. """
+    if not name:
+        return timezone.get_default_timezone()
+    if pytz is None:
+        raise ValueError('pytz is required for time zone %r' % name)
+    return pytz.timezone(name)
+
+
+def to_timestamp(value):
+    """ Seconds since the epoch of an aware, or a naive local, datetime. """
+    if timezone.is_aware(value):
+        return calendar.timegm(value.utctimetuple()) + value.microsecond / 1e6
+    return time.mktime(value.timetuple()) + value.microsecond / 1e6
+
+
+class Schedule(object):
+    """
+    A maintenance window from ``start`` to ``end``, repeated every day or week
+    at the same wall-clock time of ``tz`` when ``recurrence`` is set.
+    """
+
+    def __init__(self, start, end, recurrence=ONCE, tz=None):
+        self.start = start
+        self.end = end
+        self.period = PERIODS.get(recurrence)
+        self.tz = tz
+
+    def _local(self, value):
+        if timezone.is_aware(value):
+            return timezone.localtime(value, self.tz).replace(tzinfo=None)
+        return value
+
+    def _aware(self, value, like):
+        if not timezone.is_aware(like):
+            return value
+        if hasattr(self.tz, 'localize'):  # pytz, picks a side of ambiguous DST times
+            return self.tz.localize(value)
+        return value.replace(tzinfo=self.tz)
+
+    def window(self, now):
+        """
+        Return ``(active, next transition)``: whether ``now`` is within a
+        window, and when the next window starts or the current one ends
+        (None if there are no more windows).
+        """
+        if now < self.start:
+            return False, self.start
+        if self.period is None:
+            if now < self.end:
+                return True, self.end
+            return False, None
+        # Repeat in local time, so that windows stay at the same hour across DST changes
+        start, local_now = self._local(self.start), self._local(now)
+        duration = self._local(self.end) - start
+        elapsed = local_now - start
+        periods = int(elapsed.total_seconds() // self.period.total_seconds())
+        window_start = start + self.period * periods
+        if local_now < window_start + duration:
+            return True, self._aware(window_start + duration, now)
+        return False, self._aware(window_start + self.period, now)
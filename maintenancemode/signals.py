@@ -0,0 +1,4 @@
+from django.dispatch import Signal
+
+# Sent by maintenancemode.metrics.send_signal for every request the middleware checks.
+maintenance_decision = Signal(providing_args=['request', 'decision'])
@@ -0,0 +1,321 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from django.conf import settings as django_settings
+from django.db import router, transaction
+from django.db.utils import DatabaseError
+
+from maintenancemode import events
+from maintenancemode.backends import get_backend
+from maintenancemode.conf import settings as app_settings
+from maintenancemode.matcher import get_matcher, retain_matchers, MethodURLMatcher
+
+SAFE_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'TRACE'))
+
+logger = logging.getLogger('maintenancemode')
+
+
+class MaintenanceState(object):
+    """
+    A site's Maintenance row, its ignored and blocked URL patterns.
+    ``is_being_performed`` includes scheduled maintenance, ``read_only`` limits it
+    to unsafe methods, ``ramp`` to a percentage of clients (see Maintenance.get_ramp),
+    ``blocked_urls`` are ``(pattern, methods)`` rules which apply even when it is False.
+    ``rate_limits`` maps ignored patterns to ``(rate, capacity)``, see maintenancemode.ratelimit.
+    """
+
+    def __init__(self, site_id=None, domain=None, maintenance_id=None, is_being_performed=False,
+                 ignored_patterns=(), next_transition=None, ends_at=None, blocked_urls=(),
+                 read_only=False, ramp=None, rate_limits=None):
+        self.site_id = site_id
+        self.domain = domain
+        self.maintenance_id = maintenance_id
+        self.is_being_performed = is_being_performed
+        self.read_only = is_being_performed and read_only
+        self.ramp = ramp if is_being_performed else None
+        self.ignore_urls = get_matcher(ignored_patterns)
+        self.rate_limits = rate_limits or {}
+        self.blocked_urls = get_matcher(blocked_urls, MethodURLMatcher)
+        # Timestamps of the next scheduled start or end of maintenance, and of the current end
+        self.next_transition = next_transition if next_transition is not None else float('inf')
+        self.ends_at = ends_at
+
+    def blocks(self, method, path, bucket=None):
+        """
+        Whether a request is subject to maintenance, before any exemptions.
+        While ramping, only clients whose ``bucket`` (0-99, see maintenancemode.ramp)
+        is below the current percentage are, or all of them without a bucket.
+        """
+        if self.is_being_performed and not (self.read_only and method in SAFE_METHODS):
+            if self.ramp is None or bucket is None or bucket < self.ramp_percentage():
+                return True
+        return bool(self.blocked_urls) and self.blocked_urls.match(method, path) is not None
+
+    def ramp_percentage(self):
+        """ The percentage of clients in maintenance, moving linearly along the ramp. """
+        start, end, from_percentage, to_percentage = self.ramp
+        progress = min(max((time.time() - start) / (end - start), 0.0), 1.0)
+        return from_percentage + (to_percentage - from_percentage) * progress
+
+    def retry_after(self):
+        """ Seconds until the scheduled end of maintenance, or None. """
+        if self.ends_at is None:
+            return None
+        return max(0, int(self.ends_at - time.time()))
+
+
+class MaintenanceSnapshot(object):
+    """
+    The MaintenanceState of every site, by site id and by domain.
+
+    The snapshot is kept in process memory and trusted for STATE_TTL seconds
+    (or the ``ttl`` of the state backend).
+    After that the state backend's generation is checked, and the snapshot is
+    only loaded again when the generation has changed, or when a scheduled
+    maintenance starts or ends.
+
+    ``default`` is the state of sites missing from the snapshot, if None their
+    Maintenance records are created.
+    """
+
+    def __init__(self, states=(), generation=None, default=None):
+        self.by_site_id = dict((state.site_id, state) for state in states)
+        self.by_host = dict((state.domain.lower(), state) for state in states if state.domain)
+        self.generation = generation
+        self.default = default
+        transitions = [state.next_transition for state in states]
+        if default is not None:
+            transitions.append(default.next_transition)
+        self.next_transition = min(transitions or [float('inf')])
+        self.checked_at = time.time()
+        retain_matchers([matcher for state in list(states) + [default] if state is not None
+                         for matcher in (state.ignore_urls, state.blocked_urls)])
+
+    def get(self, site_id):
+        state = self.by_site_id.get(site_id)
+        if state is None:
+            state = self.default
+            if state is None:
+                from maintenancemode.models import Maintenance
+                try:
+                    Maintenance.objects.provision()
+                except DatabaseError:
+                    pass
+                state = self.by_site_id[site_id] = MaintenanceState(site_id)
+        return state
+
+    def get_by_host(self, host):
+        """ The state of the site whose domain is ``host`` (with or without the port), or None. """
+        host = host.lower()
+        state = self.by_host.get(host)
+        if state is None and host.rfind(':') > host.rfind(']'):
+            state = self.by_host.get(host.rsplit(':', 1)[0])
+        return state
+
+
+# The state of hosts which are no site
+NO_MAINTENANCE = MaintenanceState()
+# Unknown hosts are remembered in the snapshot up to this many hosts, so that made up
+# Host headers can't grow it without bounds
+MAX_HOSTS = 10000
+
+_snapshot = None
+# Counts reload() and invalidate() calls: a load which began before the latest of
+# them may have read the state before a change, it must not replace their result.
+_reloads = 0
+_reloads_lock = threading.Lock()
+
+
+def get_snapshot():
+    """ Return the cached MaintenanceSnapshot, reloading it if stale. """
+    snapshot = _snapshot
+    now = time.time()
+    backend = get_backend()
+    if snapshot is not None and now < snapshot.next_transition:
+        ttl = backend.ttl
+        if ttl is None:
+            ttl = app_settings.EVENT_FALLBACK_TTL if events.is_listening() else app_settings.STATE_TTL
+        if now - snapshot.checked_at < ttl:
+            return snapshot
+    else:
+        snapshot = None
+
+    events.start_listener()
+    generation = backend.get_generation()
+    if snapshot is not None and generation is not None and generation == snapshot.generation:
+        snapshot.checked_at = now
+        return snapshot
+
+    reloads = _reloads
+    snapshot = backend.load(generation=generation)
+    _install(snapshot, reloads)
+    return snapshot
+
+
+def reload():
+    """ Load the state now, used when a state change event arrives (see maintenancemode.events). """
+    global _reloads
+    with _reloads_lock:
+        _reloads += 1
+        reloads = _reloads
+    backend = get_backend()
+    _install(backend.load(generation=backend.get_generation()), reloads)
+
+
+def _install(snapshot, reloads):
+    """ Cache ``snapshot``, unless reload() or invalidate() was called since its load began. """
+    global _snapshot
+    with _reloads_lock:
+        if reloads == _reloads:
+            _snapshot = snapshot
+
+
+def get_state(site):
+    """ Return the cached MaintenanceState of ``site``. """
+    return get_snapshot().get(site.pk)
+
+
+def get_current_state(request):
+    """
+    Return the cached MaintenanceState of the request's site: the SITE_ID site,
+    or, without SITE_ID, the site whose domain is the request's host.
+    """
+    snapshot = get_snapshot()
+    site_id = getattr(django_settings, 'SITE_ID', None)
+    if site_id is not None:
+        return snapshot.get(site_id)
+    host = request.get_host()
+    state = snapshot.get_by_host(host)
+    if state is None and snapshot.default is not None:
+        return snapshot.default
+    if state is None:
+        # A site without a Maintenance record yet, or a host which is no site at all
+        site_id = _get_site_id(host)
+        if site_id is not None:
+            return snapshot.get(site_id)
+        state = NO_MAINTENANCE
+        if len(snapshot.by_host) < MAX_HOSTS:
+            snapshot.by_host[host.lower()] = state
+    return state
+
+
+def _get_site_id(host):
+    """ The id of the Site whose domain is ``host`` (with or without the port), or None. """
+    from django.contrib.sites.models import Site
+
+    domains = [host]
+    if host.rfind(':') > host.rfind(']'):
+        domains.append(host.rsplit(':', 1)[0])
+    site_ids = dict(Site.objects.filter(domain__in=domains).values_list('domain', 'pk'))
+    for domain in domains:
+        if domain in site_ids:
+            return site_ids[domain]
+    return None
+
+
+def invalidate():
+    """ Drop the cached state, in this process only. """
+    global _snapshot, _reloads
+    with _reloads_lock:
+        _reloads += 1
+        _snapshot = None
+
+
+_batch = threading.local()
+
+
+@contextmanager
+def batched_changes():
+    """
+    Announce the state changes made inside the block (e.g. saving hundreds of
+    ignored URLs) once, at its end, instead of once per saved or deleted row.
+    """
+    depth = getattr(_batch, 'depth', 0)
+    if depth == 0:
+        _batch.changed = False
+    _batch.depth = depth + 1
+    try:
+        yield
+    finally:
+        _batch.depth = depth
+        if depth == 0 and _batch.changed:
+            state_changed()
+
+
+def state_changed():
+    """
+    Drop the local state, tell other workers to reload theirs (see
+    maintenancemode.events) and rebuild the static export in the background
+    (see maintenancemode.export).
+    Within batched_changes(), this waits until the end of the batch.
+    Return the new generation of the state backend, None if it has none or isn't
+    bumped yet (until the transaction commits, or the batch ends).
+    """
+    from maintenancemode.export import export_soon
+
+    if getattr(_batch, 'depth', 0):
+        _batch.changed = True
+        return None
+    invalidate()
+    backend = get_backend()
+    if hasattr(transaction, 'on_commit'):  # Django>=1.9
+        generations = []
+        transaction.on_commit(lambda: generations.append(backend.bump_generation()))
+        transaction.on_commit(events.publish)
+        transaction.on_commit(export_soon)
+        return generations[0] if generations else None
+    generation = backend.bump_generation()
+    if generation is not None:
+        _bump_after_commit(backend)
+    events.publish()
+    export_soon()
+    return generation
+
+
+_watched = set()
+_watched_lock = threading.Lock()
+
+
+def _bump_after_commit(backend):
+    """
+    Django<1.9 has no transaction.on_commit(), so inside a transaction the
+    generation is bumped before the changes are visible to other workers. One
+    which reloads in between would keep the old rows under the new generation:
+    bump it once more when the transaction is over, from a thread watching it.
+    """
+    from maintenancemode.models import Maintenance
+
+    connection = transaction.get_connection(router.db_for_write(Maintenance))
+    if not connection.in_atomic_block:
+        return
+    with _watched_lock:
+        if (connection, backend) in _watched:
+            return  # the bump to come covers this change as well
+        _watched.add((connection, backend))
+    watcher = threading.Thread(target=_watch_transaction, args=(connection, backend),
+                               name='maintenancemode-commit')
+    watcher.daemon = True
+    watcher.start()
+
+
+def _watch_transaction(connection, backend):
+    from maintenancemode.export import export_soon
+
+    delay = 0.01
+    while connection.in_atomic_block:
+        threading.Event().wait(delay)
+        delay = min(delay * 2, 1)
+    with _watched_lock:
+        _watched.discard((connection, backend))
+    try:
+        backend.bump_generation()
+    except Exception:
+        logger.warning('Could not bump the maintenance state generation', exc_info=True)
+    export_soon()
+
+
+def _state_changed_on_save(sender, **kwargs):
+    """ post_save and post_delete receiver of the models, connected in apps.MaintenanceModeConfig. """
+    state_changed()
@@ -1,17 +1,59 @@
-from django.template import Context, loader, RequestContext
+import hashlib
 
+from django.template import loader, RequestContext
+from django.utils.translation import get_language
+
+from maintenancemode.conf import settings as app_settings
 from maintenancemode.http import HttpResponseTemporaryUnavailable
+from maintenancemode.state import get_current_state
+
+# (site id, language, template name) => (state, content, etag)
+_rendered = {}
+
 
 def temporary_unavailable(request, template_name='503.html'):
     """
     Default 503 handler, which looks for the requested URL in the redirects
     table, redirects if found, and displays 404 page if not redirected.
-    
+
+    With MAINTENANCE_MODE_RESPONSE_CACHE enabled the template is rendered once per
+    site, language and maintenance state, without a RequestContext, and the same
+    bytes are served to everybody along with ETag and Cache-Control headers.
+
     Templates: `503.html`
     Context:
         request_path
-            The path of the requested URL (e.g., '/app/pages/bad_page/')
+            The path of the requested URL (e.g., '/app/pages/bad_page/'),
+            not available with MAINTENANCE_MODE_RESPONSE_CACHE.
     """
+    state = get_current_state(request)
+    if app_settings.RESPONSE_CACHE:
+        return cached_temporary_unavailable(state, template_name)
     return HttpResponseTemporaryUnavailable(loader.render_to_string(template_name, {
         'request_path': request.path,
-    }, RequestContext(request)))
+    }, RequestContext(request)), retry_after=_retry_after(state))
+
+
+def _retry_after(state):
+    """ The end of scheduled maintenance, or MAINTENANCE_MODE_RETRY_AFTER. """
+    retry_after = state.retry_after()
+    return retry_after if retry_after is not None else app_settings.RETRY_AFTER
+
+
+def cached_temporary_unavailable(state, template_name='503.html', retry_after=None):
+    """
+    The 503 page of the site of ``state``, rendered without a request and
+    shared by all requests until the state changes. ``retry_after`` overrides
+    the Retry-After of the state.
+    """
+    key = (state.site_id, get_language(), template_name)
+    rendered = _rendered.get(key)
+    if rendered is None or rendered[0] is not state:
+        content = loader.render_to_string(template_name, {}).encode('utf-8')
+        rendered = _rendered[key] = (state, content, hashlib.md5(content).hexdigest())
+    return HttpResponseTemporaryUnavailable(
+        rendered[1],
+        retry_after=retry_after if retry_after is not None else _retry_after(state),
+        etag=rendered[2],
+        cache_control='public, max-age=%d' % app_settings.RESPONSE_MAX_AGE,
+    )
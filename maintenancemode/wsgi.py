@@ -0,0 +1,87 @@
+"""
+WSGI entry point which answers blocked requests before Django's request handling.
+
+Use it in place of Django's in your project's wsgi.py::
+
+    from maintenancemode.wsgi import get_wsgi_application
+    application = get_wsgi_application()
+
+While maintenance is being performed, requests without a session cookie or bypass
+token, not from INTERNAL_IPS, not let through by a permission processor which doesn't
+require a user and not matching an ignored URL get the 503 page straight away,
+without going through the middleware, session and auth machinery. Everything
+else is handed to Django, where MaintenanceModeMiddleware has the final say.
+
+The gate's 503 page is always rendered from the ``503.html`` template (see
+``maintenancemode.views.defaults.cached_temporary_unavailable``), a ``handler503``
+of the ROOT_URLCONF is only used by the middleware.
+"""
+from django.core.wsgi import get_wsgi_application as get_django_wsgi_application
+
+
+class MaintenanceModeGate(object):
+
+    def __init__(self, application):
+        from django.conf import settings
+
+        self.application = application
+        self.settings = settings
+
+    def __call__(self, environ, start_response):
+        response = self.get_response(environ)
+        if response is None:
+            return self.application(environ, start_response)
+        status = '%d %s' % (response.status_code, response.reason_phrase)
+        start_response(status, list(response.items()))
+        return [response.content]
+
+    def get_response(self, environ):
+        """ Return the 503 response for ``environ``, or None to let Django handle it. """
+        from django.apps import apps
+        from django.core.exceptions import SuspiciousOperation
+        from django.core.handlers.wsgi import WSGIRequest
+        from django.http import parse_cookie
+        from django.utils.functional import SimpleLazyObject
+        from maintenancemode.bypass import has_valid_token
+        from maintenancemode import ratelimit
+        from maintenancemode.networks import is_allowed_address
+        from maintenancemode.ramp import get_bucket_from
+        from maintenancemode.registry import get_permission_context
+        from maintenancemode.state import get_current_state
+        from maintenancemode.views.defaults import cached_temporary_unavailable
+
+        request = WSGIRequest(environ)
+        try:
+            state = get_current_state(request)
+        except SuspiciousOperation:
+            return None  # let Django deal with bad hosts
+        path_info = request.path_info
+        bucket = get_bucket_from(request.COOKIES, environ) if state.ramp is not None else None
+        if not state.blocks(request.method, path_info, bucket):
+            return None
+        if environ.get('REMOTE_ADDR') in self.settings.INTERNAL_IPS or is_allowed_address(environ):
+            return None
+        # Logged in users might be allowed by a permission processor, let the middleware decide
+        if 'HTTP_COOKIE' in environ and \
+                self.settings.SESSION_COOKIE_NAME in parse_cookie(environ['HTTP_COOKIE']):
+            return None
+        if has_valid_token(request):
+            return None
+        # Without a session cookie, processors which require a user are skipped. The
+        # others may still read request.user, which can only be anonymous here.
+        if apps.is_installed('django.contrib.auth'):
+            from django.contrib.auth.models import AnonymousUser
+            request.user = SimpleLazyObject(AnonymousUser)
+        if get_permission_context(request).granted_by() is not None:
+            return None
+        pattern = state.ignore_urls.match(path_info)
+        if pattern is not None:
+            if not ratelimit.admit(state, pattern):
+                return cached_temporary_unavailable(state, retry_after=ratelimit.retry_after(state, pattern))
+            environ[ratelimit.ADMITTED_KEY] = pattern  # don't count it again in the middleware
+            return None
+        return cached_temporary_unavailable(state)
+
+
+def get_wsgi_application():
+    return MaintenanceModeGate(get_django_wsgi_application())
@@ -22,9 +22,15 @@ setup(
     url='https://github.com/frnhr/django-maintenancemode/',
     packages=[
         'maintenancemode',
+        'maintenancemode.backends',
+        'maintenancemode.management',
+        'maintenancemode.management.commands',
         'maintenancemode.views',
         'maintenancemode.migrations',
     ],
+    package_data={
+        'maintenancemode': ['templates/admin/maintenancemode/maintenance/*.html'],
+    },
     classifiers=[
             'Development Status :: 4 - Beta',
             'Environment :: Web Environment',
@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+"""
+Benchmarks of MaintenanceModeMiddleware.process_request, run against a test
+database of the bundled testproject::
+
+    ./benchmark.py --output results.json
+    ./benchmark.py --compare results.json
+
+Every scenario reports requests per second and database queries per request.
+The staff scenario sends the session cookie of a logged in staff user through
+SessionMiddleware and AuthenticationMiddleware, so that loading the session and
+user is part of it.
+Startup costs are measured in fresh processes: ``django.setup()``, importing
+the middleware, and the first request (instantiating the middleware, loading
+the state). Results are written as JSON, and ``--compare`` prints the change
+against an earlier results file.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'testproject.settings')
+    import django
+    django.setup()
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+
+
+class Benchmark(object):
+
+    def __init__(self, requests):
+        from django.conf import settings
+        from django.contrib.auth.middleware import AuthenticationMiddleware
+        from django.contrib.auth.models import AnonymousUser, User
+        from django.contrib.sessions.middleware import SessionMiddleware
+        from django.contrib.sites.models import Site
+        from django.test import Client, RequestFactory
+        from maintenancemode.middleware import MaintenanceModeMiddleware
+        from maintenancemode.models import Maintenance
+
+        self.requests = requests
+        self.factory = RequestFactory()
+        self.middleware = MaintenanceModeMiddleware()
+        self.anonymous = AnonymousUser()
+        self.staff = User.objects.create_user('staff', 'staff@example.org', 'pw')
+        self.staff.is_staff = True
+        self.staff.save()
+        client = Client()
+        client.login(username='staff', password='pw')
+        self.staff_cookie = '%s=%s' % (settings.SESSION_COOKIE_NAME,
+                                       client.cookies[settings.SESSION_COOKIE_NAME].value)
+        self.session_middleware = (SessionMiddleware(), AuthenticationMiddleware())
+        self.maintenance = Maintenance.objects.get_or_create(site=Site.objects.get_current())[0]
+
+    def set_maintenance(self, is_being_performed, ignored_patterns=0):
+        self.maintenance.is_being_performed = is_being_performed
+        self.maintenance.save()
+        self.maintenance.ignoredurl_set.all().delete()
+        for i in range(ignored_patterns):
+            # The pattern which matches is the last one
+            pattern = r'^/ignored/' if i == ignored_patterns - 1 else r'^/unused-%d/(\d+)/' % i
+            self.maintenance.ignoredurl_set.create(pattern=pattern, description='benchmark')
+
+    def measure(self, name, path='/', session=False, **meta):
+        """
+        Without ``session``, requests come with an anonymous user. With it, they
+        carry the staff user's session cookie and go through the session and
+        authentication middleware first, which is measured too.
+        """
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        middleware = (self.session_middleware if session else ()) + (self.middleware,)
+        if session:
+            meta['HTTP_COOKIE'] = self.staff_cookie
+
+        def request():
+            r = self.factory.get(path, **meta)
+            if not session:
+                r.user = self.anonymous
+            return r
+
+        def process(r):
+            for m in middleware:
+                m.process_request(r)
+
+        process(request())  # warm up caches
+        requests = [request() for i in range(self.requests)]
+        with CaptureQueriesContext(connection) as queries:
+            start = time.time()
+            for r in requests:
+                process(r)
+            duration = time.time() - start
+        return {
+            'scenario': name,
+            'requests': self.requests,
+            'seconds': duration,
+            'requests_per_second': self.requests / duration if duration else None,
+            'queries_per_request': len(queries) / float(self.requests),
+        }
+
+    def run(self):
+        from django.test.utils import override_settings
+
+        results = []
+        self.set_maintenance(False)
+        results.append(self.measure('maintenance_off'))
+        self.set_maintenance(True)
+        results.append(self.measure('maintenance_on_anonymous'))
+        results.append(self.measure('maintenance_on_staff', session=True))
+        with override_settings(INTERNAL_IPS=('10.0.0.1',)):
+            results.append(self.measure('maintenance_on_internal_ip', REMOTE_ADDR='10.0.0.1'))
+        for patterns in (10, 100, 1000):
+            self.set_maintenance(True, ignored_patterns=patterns)
+            results.append(self.measure('ignored_url_%d_patterns' % patterns, path='/ignored/'))
+        return results
+
+
+def startup_child():
+    """ Measure the startup of this (fresh) process, print the timings as JSON. """
+    start = time.time()
+    setup_django()
+    setup = time.time()
+    from maintenancemode.middleware import MaintenanceModeMiddleware
+    imported = time.time()
+
+    from django.db import connection
+    from django.test import RequestFactory
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        request = RequestFactory().get('/')
+        request_start = time.time()
+        MaintenanceModeMiddleware().process_request(request)
+        first_request = time.time() - request_start
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+    print(json.dumps({
+        'django_setup': setup - start,
+        'middleware_import': imported - setup,
+        'first_request': first_request,
+    }))
+
+
+def measure_startup(runs):
+    """ Median startup timings of ``runs`` fresh processes. """
+    timings = {}
+    for i in range(runs):
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--startup-child'])
+        for name, seconds in json.loads(output.decode('utf-8').strip().splitlines()[-1]).items():
+            timings.setdefault(name, []).append(seconds)
+    return dict((name, sorted(values)[len(values) // 2]) for name, values in timings.items())
+
+
+def compare(results, previous):
+    before_startup = previous.get('startup', {})
+    for name, seconds in sorted(results.get('startup', {}).items()):
+        if before_startup.get(name):
+            print('startup_%-24s %+7.1f%% time  %.1f -> %.1f ms' % (
+                name, 100.0 * (seconds / before_startup[name] - 1), before_startup[name] * 1000, seconds * 1000))
+    previous = dict((result['scenario'], result) for result in previous['results'])
+    for result in results['results']:
+        before = previous.get(result['scenario'])
+        if not before or not before['requests_per_second']:
+            continue
+        print('%-32s %+7.1f%% req/s   queries/request %.2f -> %.2f' % (
+            result['scenario'],
+            100.0 * (result['requests_per_second'] / before['requests_per_second'] - 1),
+            before['queries_per_request'],
+            result['queries_per_request'],
+        ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=2000, help='requests per scenario')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare with the results in this JSON file')
+    parser.add_argument('--startup-runs', type=int, default=5,
+                        help='fresh processes measuring the startup, 0 to skip it')
+    parser.add_argument('--startup-child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.startup_child:
+        startup_child()
+        return 0
+    startup = measure_startup(args.startup_runs) if args.startup_runs else {}
+
+    setup_django()
+    import django
+    from django.db import connection
+
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        results = {
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'timestamp': time.time(),
+            'results': Benchmark(args.requests).run(),
+            'startup': startup,
+        }
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    for name, seconds in sorted(startup.items()):
+        print('startup_%-24s %10.1f ms' % (name, seconds * 1000))
+    for result in results['results']:
+        print('%-32s %10.0f req/s %6.2f queries/request' % (
+            result['scenario'], result['requests_per_second'] or 0, result['queries_per_request']))
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
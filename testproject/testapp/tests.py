@@ -1,16 +1,50 @@
 import re
 import os.path
+import time
 from django import VERSION as DJANGO_VERSION
 from django.conf import settings
 from django.contrib.sites.models import Site
 from django.template import TemplateDoesNotExist
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
 from django.test.client import Client
-from maintenancemode.models import Maintenance
+from maintenancemode import metrics, state
+from maintenancemode.matcher import URLMatcher, MethodURLMatcher, split_literal_prefix
+from maintenancemode.networks import NetworkSet
+from maintenancemode.models import Maintenance, IgnoredURL, BlockedURL
 
 
 _django_18 = DJANGO_VERSION[0] >= 1 and DJANGO_VERSION[1] >= 8
 
+processor_calls = []
+
+
+def cheap_processor(request):
+    processor_calls.append('cheap')
+    return True
+cheap_processor.cost = 1
+
+
+def expensive_processor(request):
+    processor_calls.append('expensive')
+    return False
+
+
+def user_processor(request):
+    processor_calls.append('user')
+    return request.user.is_staff
+user_processor.requires_user = True
+
+
+def legacy_processor(request):
+    # Written before ``requires_user`` existed
+    processor_calls.append('legacy')
+    return request.user.is_staff
+
+
+def header_processor(request):
+    processor_calls.append('header')
+    return request.META.get('HTTP_X_MONITORING') == 'secret'
+
 
 # noinspection PyUnresolvedReferences
 class TestDataMixin(object):
@@ -90,6 +124,8 @@ class TestDataMixin(object):
         Maintenance.objects.filter(id=self.maintenance.id).update(
             is_being_performed=is_being_performed,
         )
+        # queryset.update() does not send post_save, so drop the cached state by hand
+        state.invalidate()
 
     def assertMaintenanceMode(self, response):
         self.assertContains(response, text='Temporary unavailable', count=1, status_code=503)
@@ -123,6 +159,16 @@ class MaintenanceModeMiddlewareTestCase(TestDataMixin, TestCase):
         with self.settings(**self.TEMPLATES_WITHOUT):
             self.assertRaises(TemplateDoesNotExist, self.client.get, '/')
 
+    def test_custom_handler503(self):
+        """ A handler503 in the ROOT_URLCONF replaces the default view, without global changes """
+        import django.conf.urls
+        self._set_model_to(True)
+        with self.settings(ROOT_URLCONF='testapp.urls_handler503'):
+            self.assertContains(self.client.get('/'), 'Custom maintenance page', status_code=503)
+        with self.settings(**self.TEMPLATES_WITH):
+            self.assertMaintenanceMode(self.client.get('/'))
+        self.assertFalse(hasattr(django.conf.urls, 'handler503'))
+
     def test_enabled_middleware_with_template(self):
         """ Enabling the middleware having a 503.html in any of the template
             locations should return the rendered template
@@ -162,6 +208,29 @@ class MaintenanceModeMiddlewareTestCase(TestDataMixin, TestCase):
             response = client.get('/')
         self.assertNormalMode(response)
 
+    def test_middleware_with_allowed_networks(self):
+        """ A user visiting from a network in MAINTENANCE_MODE_ALLOWED_NETWORKS
+            should be able to use the site normally
+        """
+        self._set_model_to(True)
+        with self.settings(MAINTENANCE_MODE_ALLOWED_NETWORKS=('10.0.0.0/8', '2001:db8::/32'),
+                           **self.TEMPLATES_WITH):
+            self.assertNormalMode(Client(REMOTE_ADDR='10.1.2.3').get('/'))
+            self.assertNormalMode(Client(REMOTE_ADDR='2001:db8::1').get('/'))
+            self.assertMaintenanceMode(Client(REMOTE_ADDR='192.168.1.1').get('/'))
+
+    def test_middleware_with_trusted_proxies(self):
+        """ X-Forwarded-For should only be used when set by a trusted proxy """
+        self._set_model_to(True)
+        with self.settings(MAINTENANCE_MODE_ALLOWED_NETWORKS=('10.0.0.0/8',),
+                           MAINTENANCE_MODE_TRUSTED_PROXIES=('192.168.0.0/16',),
+                           **self.TEMPLATES_WITH):
+            proxied = Client(REMOTE_ADDR='192.168.1.1')
+            self.assertNormalMode(proxied.get('/', HTTP_X_FORWARDED_FOR='10.1.2.3, 192.168.1.2'))
+            self.assertMaintenanceMode(proxied.get('/', HTTP_X_FORWARDED_FOR='10.1.2.3, 8.8.8.8'))
+            direct = Client(REMOTE_ADDR='8.8.8.8')
+            self.assertMaintenanceMode(direct.get('/', HTTP_X_FORWARDED_FOR='10.1.2.3'))
+
     def test_ignored_path(self):
         """ A path is ignored when applying the maintenance mode and
             should be reachable normally
@@ -170,6 +239,1281 @@ class MaintenanceModeMiddlewareTestCase(TestDataMixin, TestCase):
             response = self.client.get('/ignored/')
         self.assertNormalMode(response)
 
+    def test_new_style_middleware(self):
+        """ The middleware should also work when called with get_response (MIDDLEWARE) """
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+        from maintenancemode.middleware import MaintenanceModeMiddleware
+        middleware = MaintenanceModeMiddleware(lambda request: HttpResponse('Rendered response page'))
+        self.assertNormalMode(middleware(RequestFactory().get('/')))
+        self._set_model_to(True)
+        with self.settings(**self.TEMPLATES_WITH):
+            response = middleware(RequestFactory().get('/'))
+        self.assertMaintenanceMode(response)
+
+    def test_blocked_url(self):
+        """ A blocked URL should be in maintenance while the rest of the site works normally """
+        BlockedURL.objects.create(maintenance=self.maintenance, pattern=r'^/ignored/',
+                                  description='blocked')
+        with self.settings(**self.TEMPLATES_WITH):
+            self.assertMaintenanceMode(self.client.get('/ignored/'))
+            self.assertNormalMode(self.client.get('/'))
+            self.client.login(username='staff_user', password='maintenance_pw')
+            self.assertNormalMode(self.client.get('/ignored/'))
+
+    def test_blocked_url_methods(self):
+        """ A blocked URL limited to some methods should only block those """
+        BlockedURL.objects.create(maintenance=self.maintenance, pattern=r'^/ignored/',
+                                  methods='post, put', description='blocked')
+        with self.settings(**self.TEMPLATES_WITH):
+            self.assertNormalMode(self.client.get('/ignored/'))
+            self.assertMaintenanceMode(self.client.post('/ignored/'))
+
+    def test_read_only_mode(self):
+        """ Read-only maintenance should only block unsafe methods """
+        Maintenance.objects.filter(id=self.maintenance.id).update(mode=Maintenance.READ_ONLY)
+        self._set_model_to(True)
+        with self.settings(**self.TEMPLATES_WITH):
+            self.assertNormalMode(self.client.get('/'))
+            self.assertMaintenanceMode(self.client.post('/'))
+
+    def test_read_only_router(self):
+        """ Reads of requests served during read-only maintenance should go to READ_ONLY_DATABASE """
+        from django.contrib.auth.models import User
+        from django.http import HttpResponse
+        from django.test import RequestFactory
+        from maintenancemode.middleware import MaintenanceModeMiddleware
+        from maintenancemode.routers import ReadOnlyMaintenanceRouter
+        router = ReadOnlyMaintenanceRouter()
+        databases = []
+
+        def view(request):
+            databases.append(router.db_for_read(User))
+            return HttpResponse('Rendered response page')
+
+        middleware = MaintenanceModeMiddleware(view)
+        with self.settings(MAINTENANCE_MODE_READ_ONLY_DATABASE='replica'):
+            middleware(RequestFactory().get('/'))
+            Maintenance.objects.filter(id=self.maintenance.id).update(mode=Maintenance.READ_ONLY)
+            self._set_model_to(True)
+            middleware(RequestFactory().get('/'))
+        self.assertEqual(databases, [None, 'replica'])
+        self.assertIsNone(router.db_for_read(User))
+
+    def test_retry_after(self):
+        """ MAINTENANCE_MODE_RETRY_AFTER should be sent with the 503 page """
+        self._set_model_to(True)
+        with self.settings(MAINTENANCE_MODE_RETRY_AFTER=120, **self.TEMPLATES_WITH):
+            response = self.client.get('/')
+        self.assertMaintenanceMode(response)
+        self.assertEqual(response['Retry-After'], '120')
+
+    def test_scheduled_maintenance(self):
+        """ During a scheduled window the site should be in maintenance,
+            with Retry-After set to the end of the window
+        """
+        from datetime import timedelta
+        from django.utils import timezone
+        now = timezone.now()
+        self.maintenance.scheduled_start = now - timedelta(minutes=5)
+        self.maintenance.scheduled_end = now + timedelta(hours=1)
+        self.maintenance.save()
+        with self.settings(**self.TEMPLATES_WITH):
+            response = self.client.get('/')
+        self.assertMaintenanceMode(response)
+        self.assertTrue(3500 < int(response['Retry-After']) <= 3600)
+
+    def test_future_scheduled_maintenance(self):
+        """ Before a scheduled window, the site should work normally until the window starts """
+        from datetime import timedelta
+        from django.utils import timezone
+        now = timezone.now()
+        self.maintenance.scheduled_start = now + timedelta(hours=1)
+        self.maintenance.scheduled_end = now + timedelta(hours=2)
+        self.maintenance.save()
+        self.assertNormalMode(self.client.get('/'))
+        cached = state.get_state(self.site)
+        self.assertAlmostEqual(cached.next_transition, time.time() + 3600, delta=5)
+
+    def test_cached_response(self):
+        """ With MAINTENANCE_MODE_RESPONSE_CACHE, the 503 page should be rendered once
+            and served with caching headers
+        """
+        self._set_model_to(True)
+        with self.settings(MAINTENANCE_MODE_RESPONSE_CACHE=True, **self.TEMPLATES_WITH):
+            first = self.client.get('/')
+            second = self.client.get('/ignored/')
+        self.assertMaintenanceMode(first)
+        self.assertMaintenanceMode(second)
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertEqual(first['Cache-Control'], 'public, max-age=5')
+
+
+class MetricsTestCase(TestDataMixin, TestCase):
+
+    def setUp(self):
+        from maintenancemode.metrics import counter
+        super(MetricsTestCase, self).setUp()
+        self._set_model_to(True)
+        counter.reset()
+
+    def test_decision_signal(self):
+        from maintenancemode.signals import maintenance_decision
+        decisions = []
+
+        def record(sender, request, decision, **kwargs):
+            decisions.append(decision)
+
+        maintenance_decision.connect(record)
+        try:
+            with self.settings(MAINTENANCE_MODE_METRICS_SINKS=('maintenancemode.metrics.send_signal',),
+                               **self.TEMPLATES_WITH):
+                self.client.get('/')
+                self.client.login(username='staff_user', password='maintenance_pw')
+                self.client.get('/')
+        finally:
+            maintenance_decision.disconnect(record)
+        self.assertEqual([(d.reason, d.detail) for d in decisions], [
+            ('blocked', None),
+            ('permission_processor', 'maintenancemode.permission_processors.is_staff'),
+        ])
+        self.assertTrue(decisions[0].blocked)
+        self.assertGreaterEqual(decisions[0].duration, 0)
+
+    def test_prometheus_export(self):
+        from maintenancemode.metrics import counter
+        IgnoredURL.objects.create(maintenance=self.maintenance, pattern=r'^/ignored/',
+                                  description='ignored')
+        with self.settings(MAINTENANCE_MODE_METRICS_SINKS=('maintenancemode.metrics.counter',),
+                           **self.TEMPLATES_WITH):
+            self.client.get('/')
+            self.client.get('/')
+            self.client.get('/ignored/')
+        exported = counter.export_prometheus()
+        self.assertIn('maintenancemode_decisions_total{reason="blocked",detail=""} 2\n', exported)
+        self.assertIn('maintenancemode_decisions_total{reason="ignored_url",detail="^/ignored/"} 1\n',
+                      exported)
+
+
+class MaintenanceStateTestCase(TestDataMixin, TestCase):
+
+    def setUp(self):
+        super(MaintenanceStateTestCase, self).setUp()
+        self._set_model_to(False)
+
+    def test_disabled_middleware_uses_cached_state(self):
+        """ Once the state is cached, requests outside maintenance should not query the database """
+        self.client.get('/')
+        with self.assertNumQueries(0):
+            response = self.client.get('/')
+        self.assertNormalMode(response)
+
+    def test_save_invalidates_cached_state(self):
+        """ Saving a Maintenance row should take effect on the very next request """
+        self.assertNormalMode(self.client.get('/'))
+        self.maintenance.is_being_performed = True
+        self.maintenance.save()
+        with self.settings(**self.TEMPLATES_WITH):
+            response = self.client.get('/')
+        self.assertMaintenanceMode(response)
+
+    def test_ignored_url_save_invalidates_cached_state(self):
+        """ Adding an IgnoredURL should take effect on the very next request """
+        self._set_model_to(True)
+        with self.settings(**self.TEMPLATES_WITH):
+            self.assertMaintenanceMode(self.client.get('/ignored/'))
+            IgnoredURL.objects.create(maintenance=self.maintenance, pattern=r'^/ignored/',
+                                      description='ignored')
+            response = self.client.get('/ignored/')
+        self.assertNormalMode(response)
+
+    def test_stale_state_is_reloaded(self):
+        """ State older than STATE_TTL should be read again from the database """
+        self.client.get('/')
+        Maintenance.objects.filter(id=self.maintenance.id).update(is_being_performed=True)
+        self.assertNormalMode(self.client.get('/'))
+        with self.settings(MAINTENANCE_MODE_STATE_TTL=0, **self.TEMPLATES_WITH):
+            response = self.client.get('/')
+        self.assertMaintenanceMode(response)
+
+
+class ProvisioningTestCase(TestDataMixin, TestCase):
+
+    def test_missing_records_are_provisioned(self):
+        """ A request for a site without a Maintenance record should create the missing ones """
+        other_site = Site.objects.create(domain='other.example.org', name='other')
+        self.maintenance.delete()
+        self.assertNormalMode(self.client.get('/'))
+        self.assertEqual(set(Maintenance.objects.values_list('site_id', flat=True)),
+                         set([self.site.pk, other_site.pk]))
+
+    def test_provision_is_idempotent(self):
+        Site.objects.create(domain='other.example.org', name='other')
+        self.assertEqual(Maintenance.objects.provision(), 1)
+        self.assertEqual(Maintenance.objects.provision(), 0)
+
+    def test_provision_command(self):
+        from django.core.management import call_command
+        from django.utils.six import StringIO
+        Site.objects.create(domain='other.example.org', name='other')
+        out = StringIO()
+        call_command('provision_maintenance', stdout=out)
+        self.assertIn('Created 1 Maintenance record(s).', out.getvalue())
+
+    def _get_with_broken_database(self):
+        from django.db.utils import DatabaseError
+
+        def broken_get_queryset(*args, **kwargs):
+            raise DatabaseError('database is down')
+
+        import logging
+        logger = logging.getLogger('maintenancemode')
+        logger.disabled = True
+        state.invalidate()
+        Maintenance.objects.get_queryset = broken_get_queryset
+        try:
+            with self.settings(**self.TEMPLATES_WITH):
+                return self.client.get('/')
+        finally:
+            del Maintenance.objects.get_queryset
+            logger.disabled = False
+
+    def test_database_error_fails_open(self):
+        self.assertNormalMode(self._get_with_broken_database())
+
+    def test_database_error_fails_closed(self):
+        with self.settings(MAINTENANCE_MODE_DATABASE_ERROR_POLICY='closed'):
+            self.assertMaintenanceMode(self._get_with_broken_database())
+
+
+class MultiSiteTestCase(TestDataMixin, TestCase):
+
+    def setUp(self):
+        super(MultiSiteTestCase, self).setUp()
+        self._set_model_to(False)
+        self.other_sites = [Site.objects.create(domain='site%d.example.org' % i, name='site%d' % i)
+                            for i in range(5)]
+        Maintenance.objects.provision()
+        Maintenance.objects.filter(site=self.other_sites[0]).update(is_being_performed=True)
+        state.invalidate()
+
+    def test_state_of_all_sites_is_loaded_at_once(self):
+        """ Loading the state should cost the same number of queries whatever the number of sites """
+        with self.assertNumQueries(2):
+            state.get_snapshot()
+        self.assertEqual(len(state.get_snapshot().by_site_id), 6)
+
+    def test_site_by_host(self):
+        """ Without SITE_ID, the site should be found by the request's host """
+        with self.settings(SITE_ID=None, **self.TEMPLATES_WITH):
+            self.assertMaintenanceMode(self.client.get('/', HTTP_HOST='site0.example.org'))
+            self.assertMaintenanceMode(self.client.get('/', HTTP_HOST='SITE0.example.org:8000'))
+            self.assertNormalMode(self.client.get('/', HTTP_HOST='site1.example.org'))
+            self.assertNormalMode(self.client.get('/', HTTP_HOST=self.site.domain))
+
+    def test_matchers_are_reused_across_reloads(self):
+        """ Only the matchers of changed pattern sets are built again, however many sites """
+        from maintenancemode.backends import get_backend
+        from maintenancemode import matcher
+        sites = [Site.objects.create(domain='many%d.example.org' % i, name='many%d' % i) for i in range(40)]
+        Maintenance.objects.provision()
+        for site in sites:
+            IgnoredURL.objects.create(maintenance=Maintenance.objects.get(site=site),
+                                      pattern='^/%s/' % site.domain, description='Site')
+        first = get_backend().load()
+        changed = IgnoredURL.objects.get(pattern='^/many0.example.org/')
+        changed.pattern = '^/changed/'
+        changed.save()
+        second = get_backend().load()
+        for site in sites[1:]:
+            self.assertIs(second.get(site.pk).ignore_urls, first.get(site.pk).ignore_urls)
+        self.assertEqual(second.get(sites[0].pk).ignore_urls.patterns, ('^/changed/',))
+        self.assertNotIn((matcher.URLMatcher, ('^/many0.example.org/',)), matcher._matchers)
+
+    def test_unknown_host(self):
+        """ Without SITE_ID, hosts which are no site are not in maintenance, and looked up once """
+        Maintenance.objects.update(is_being_performed=True)
+        state.invalidate()
+        with self.settings(SITE_ID=None, **self.TEMPLATES_WITH):
+            self.assertNormalMode(self.client.get('/', HTTP_HOST='unknown.example.org'))
+            with self.assertNumQueries(0):
+                self.assertNormalMode(self.client.get('/', HTTP_HOST='unknown.example.org'))
+            # A new site, without a Maintenance record yet, with the port in the host
+            Site.objects.create(domain='unknown.example.org', name='unknown')
+            self.assertNormalMode(self.client.get('/', HTTP_HOST='unknown.example.org:8000'))
+            self.assertTrue(Maintenance.objects.filter(site__domain='unknown.example.org').exists())
+            Maintenance.objects.filter(site__domain='unknown.example.org').update(is_being_performed=True)
+            state.invalidate()
+            self.assertMaintenanceMode(self.client.get('/', HTTP_HOST='unknown.example.org:8000'))
+
+
+class MaintenanceCommandTestCase(TestDataMixin, TestCase):
+
+    def setUp(self):
+        super(MaintenanceCommandTestCase, self).setUp()
+        self._set_model_to(False)
+
+    def _call(self, *args, **options):
+        from django.core.management import call_command
+        from django.utils.six import StringIO
+        out = StringIO()
+        call_command('maintenance', *args, stdout=out, **options)
+        return out.getvalue()
+
+    def test_on_and_off(self):
+        self.assertNormalMode(self.client.get('/'))
+        output = self._call('on')
+        self.assertIn('Maintenance mode on for 1 site(s).', output)
+        with self.settings(**self.TEMPLATES_WITH):
+            self.assertMaintenanceMode(self.client.get('/'))
+        self._call('off')
+        self.assertNormalMode(self.client.get('/'))
+
+    def test_all_sites_with_cache_backend(self):
+        Site.objects.create(domain='other.example.org', name='other')
+        with self.settings(MAINTENANCE_MODE_STATE_BACKEND='maintenancemode.backends.cache.CacheBackend'):
+            from maintenancemode.backends import get_backend
+            generation = get_backend().get_generation()
+            output = self._call('on', all_sites=True, mode=Maintenance.READ_ONLY)
+        self.assertIn('Maintenance mode on for 2 site(s).', output)
+        self.assertIn('State generation: %s' % (generation + 1), output)
+        self.assertEqual(Maintenance.objects.filter(is_being_performed=True, mode='read_only').count(), 2)
+
+    def test_status(self):
+        self._call('on', sites=['example.com'])
+        self.assertIn('example.com: on (full)', self._call('status'))
+
+    def test_without_site_id(self):
+        from django.core.management import CommandError
+        with self.settings(SITE_ID=None):
+            self.assertRaises(CommandError, self._call, 'on')
+            self.assertIn('Maintenance mode on for 1 site(s).', self._call('on', sites=['example.com']))
+
+
+class StateBackendTestCase(TestDataMixin, TestCase):
+
+    def setUp(self):
+        super(StateBackendTestCase, self).setUp()
+        self._set_model_to(False)
+
+    def _assert_generation_drives_reload(self):
+        from maintenancemode.backends import get_backend
+        self.client.get('/')
+        # Another worker changes the database...
+        Maintenance.objects.filter(id=self.maintenance.id).update(is_being_performed=True)
+        with self.settings(MAINTENANCE_MODE_STATE_TTL=0, **self.TEMPLATES_WITH):
+            # ...which is not picked up while the generation stays the same
+            self.assertNormalMode(self.client.get('/'))
+            get_backend().bump_generation()
+            response = self.client.get('/')
+        self.assertMaintenanceMode(response)
+
+    def test_cache_backend(self):
+        with self.settings(MAINTENANCE_MODE_STATE_BACKEND='maintenancemode.backends.cache.CacheBackend'):
+            self._assert_generation_drives_reload()
+
+    def test_file_backend(self):
+        import shutil
+        import tempfile
+        state_dir = tempfile.mkdtemp()
+        try:
+            with self.settings(MAINTENANCE_MODE_STATE_BACKEND='maintenancemode.backends.file.FileBackend',
+                               MAINTENANCE_MODE_STATE_FILE=os.path.join(state_dir, 'generation')):
+                self._assert_generation_drives_reload()
+        finally:
+            shutil.rmtree(state_dir)
+
+    def test_file_backend_survives_deleted_file(self):
+        """ A deleted generation file must not restart from a generation workers have seen """
+        import shutil
+        import tempfile
+        from maintenancemode.backends.file import FileBackend
+        state_dir = tempfile.mkdtemp()
+        try:
+            with self.settings(MAINTENANCE_MODE_STATE_FILE=os.path.join(state_dir, 'generation')):
+                backend = FileBackend()
+                seen = backend.get_generation()
+                time.sleep(0.01)
+                os.remove(backend.path)
+                bumped = backend.bump_generation()
+                self.assertGreater(bumped, seen)
+                time.sleep(0.01)
+                os.remove(backend.path)
+                self.assertGreater(backend.get_generation(), bumped)
+        finally:
+            shutil.rmtree(state_dir)
+
+    def test_file_backend_permissions(self):
+        """ Workers running as another user can read the file, and don't fail if they can't """
+        import logging
+        import shutil
+        import stat
+        import tempfile
+        from maintenancemode.backends.file import FileBackend
+        state_dir = tempfile.mkdtemp()
+        try:
+            with self.settings(MAINTENANCE_MODE_STATE_FILE=os.path.join(state_dir, 'generation')):
+                backend = FileBackend()
+                generation = backend.bump_generation()
+                self.assertEqual(stat.S_IMODE(os.stat(backend.path).st_mode), 0o644)
+                self.assertEqual(backend.get_generation(), generation)
+                # A file which can't be read nor replaced
+                os.remove(backend.path)
+                os.mkdir(backend.path)
+                logging.disable(logging.WARNING)
+                try:
+                    self.assertEqual(backend.get_generation(), generation)
+                finally:
+                    logging.disable(logging.NOTSET)
+        finally:
+            shutil.rmtree(state_dir)
+
+    def test_cache_backend_checks_generation_only(self):
+        """ An unchanged generation should cost no database queries """
+        with self.settings(MAINTENANCE_MODE_STATE_BACKEND='maintenancemode.backends.cache.CacheBackend',
+                           MAINTENANCE_MODE_STATE_TTL=0):
+            self.client.get('/')
+            with self.assertNumQueries(0):
+                self.client.get('/')
+
+
+class GenerationAfterCommitTestCase(TransactionTestCase):
+
+    def test_generation_bumped_again_after_commit(self):
+        """ A worker reloading between the change and the commit must not keep the old state """
+        import shutil
+        import tempfile
+        from django.db import transaction
+        from maintenancemode.backends import get_backend
+        from maintenancemode.state import MaintenanceSnapshot, MaintenanceState
+        maintenance = Maintenance.objects.get_or_create(site=Site.objects.get_current())[0]
+        state_dir = tempfile.mkdtemp()
+        try:
+            with self.settings(MAINTENANCE_MODE_STATE_BACKEND='maintenancemode.backends.file.FileBackend',
+                               MAINTENANCE_MODE_STATE_FILE=os.path.join(state_dir, 'generation'),
+                               MAINTENANCE_MODE_STATE_TTL=0):
+                backend = get_backend()
+                with transaction.atomic():
+                    maintenance.is_being_performed = True
+                    maintenance.save()
+                    generation = backend.get_generation()
+                    # What another worker loads before the commit: the old rows, the new generation
+                    state._snapshot = MaintenanceSnapshot(
+                        [MaintenanceState(site_id=maintenance.site_id)], generation=generation)
+                for i in range(100):
+                    if backend.get_generation() != generation:
+                        break
+                    time.sleep(0.01)
+                self.assertEqual(backend.get_generation(), generation + 1)
+                self.assertTrue(state.get_state(maintenance.site).is_being_performed)
+        finally:
+            state.invalidate()
+            shutil.rmtree(state_dir)
+
+
+class FlagFileBackendTestCase(TestDataMixin, TestCase):
+
+    def setUp(self):
+        import tempfile
+        super(FlagFileBackendTestCase, self).setUp()
+        self._set_model_to(False)
+        self.flag_dir = tempfile.mkdtemp()
+        self.flag_file = os.path.join(self.flag_dir, 'maintenance.json')
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.flag_dir)
+        state.invalidate()
+        super(FlagFileBackendTestCase, self).tearDown()
+
+    def _write(self, flags):
+        import json
+        with open(self.flag_file, 'w') as f:
+            json.dump(flags, f)
+
+    def _get(self, path='/', interval=0):
+        with self.settings(MAINTENANCE_MODE_STATE_BACKEND='maintenancemode.backends.flagfile.FlagFileBackend',
+                           MAINTENANCE_MODE_FLAG_FILE=self.flag_file,
+                           MAINTENANCE_MODE_FLAG_FILE_CHECK_INTERVAL=interval,
+                           **self.TEMPLATES_WITH):
+            return self.client.get(path)
+
+    def test_missing_file_is_normal_mode(self):
+        self.assertNormalMode(self._get())
+
+    def test_file_turns_maintenance_on_without_queries(self):
+        self._write({'mode': 'full', 'ignored_urls': [r'^/ignored/']})
+        with self.assertNumQueries(0):
+            self.assertMaintenanceMode(self._get())
+            self.assertNormalMode(self._get('/ignored/'))
+
+    def test_file_changes_are_picked_up(self):
+        self._get()
+        self._write({'mode': 'full'})
+        self.assertMaintenanceMode(self._get())
+        os.remove(self.flag_file)
+        self.assertNormalMode(self._get())
+
+    def test_check_interval_replaces_state_ttl(self):
+        """ With the default STATE_TTL of 5 seconds, a change shows up after the check interval """
+        self.assertNormalMode(self._get(interval=0.1))
+        self._write({'mode': 'full'})
+        time.sleep(0.2)
+        self.assertMaintenanceMode(self._get(interval=0.1))
+
+    def test_invalid_end_follows_error_policy(self):
+        import logging
+        self._write({'mode': 'full', 'end': 'tomorrow'})
+        logging.disable(logging.WARNING)
+        try:
+            self.assertNormalMode(self._get())
+            with self.settings(MAINTENANCE_MODE_DATABASE_ERROR_POLICY='closed'):
+                self.assertMaintenanceMode(self._get())
+                self._write({'mode': 'fully'})
+                self.assertMaintenanceMode(self._get())
+        finally:
+            logging.disable(logging.NOTSET)
+
+    def test_invalid_types_follow_error_policy(self):
+        import logging
+        logging.disable(logging.WARNING)
+        try:
+            for flags in ({'mode': 'full', 'ignored_urls': '^/x'},
+                          {'mode': 'full', 'sites': {str(self.site.pk): {'ignored_urls': '^/x'}}},
+                          {'mode': 'full', 'sites': [str(self.site.pk)]},
+                          ['full']):
+                self._write(flags)
+                with self.settings(MAINTENANCE_MODE_DATABASE_ERROR_POLICY='closed'):
+                    self.assertMaintenanceMode(self._get('/y/'))
+        finally:
+            logging.disable(logging.NOTSET)
+
+    def test_site_overrides_with_site_id(self):
+        self._write({'mode': 'full', 'sites': {self.site.domain.upper(): {'mode': 'off'}}})
+        self.assertNormalMode(self._get())
+        self._write({'mode': 'off', 'sites': {str(self.site.pk): {'mode': 'full'},
+                                              self.site.domain: {'mode': 'off'}}})
+        self.assertMaintenanceMode(self._get())
+        self._write({'mode': 'full', 'sites': {'other.example.org': {'mode': 'off'}}})
+        self.assertMaintenanceMode(self._get())
+
+    def test_end_time(self):
+        self._write({'mode': 'full', 'end': '2000-01-01T00:00:00Z'})
+        self.assertNormalMode(self._get())
+        self._write({'mode': 'full', 'end': time.time() + 3600})
+        self.assertMaintenanceMode(self._get())
+
+    def test_site_override(self):
+        self._write({'mode': 'full', 'sites': {str(self.site.pk): {'mode': 'off'}}})
+        self.assertNormalMode(self._get())
+
+    def test_invalid_file_follows_error_policy(self):
+        import logging
+        with open(self.flag_file, 'w') as f:
+            f.write('{"mode": ')
+        logging.disable(logging.WARNING)
+        try:
+            self.assertNormalMode(self._get())
+            with self.settings(MAINTENANCE_MODE_DATABASE_ERROR_POLICY='closed'):
+                state.invalidate()
+                self.assertMaintenanceMode(self._get())
+        finally:
+            logging.disable(logging.NOTSET)
+
+
+class BypassTokenTestCase(TestDataMixin, TestCase):
+
+    def setUp(self):
+        super(BypassTokenTestCase, self).setUp()
+        self._set_model_to(True)
+
+    def _get(self, path='/', **settings):
+        with self.settings(MAINTENANCE_MODE_PERMISSION_PROCESSORS=(
+                'maintenancemode.permission_processors.has_bypass_token',
+        ), **dict(self.TEMPLATES_WITH, **settings)):
+            return self.client.get(path)
+
+    def test_token_sets_cookie(self):
+        from maintenancemode.bypass import make_token
+        self.assertMaintenanceMode(self._get())
+        response = self._get('/?maintenance_bypass=%s' % make_token('qa'))
+        self.assertNormalMode(response)
+        self.assertIn('maintenance_bypass', response.cookies)
+        with self.assertNumQueries(0):
+            self.assertNormalMode(self._get())
+
+    def test_invalid_token(self):
+        self.assertMaintenanceMode(self._get('/?maintenance_bypass=qa:1abc:forged'))
+        self.client.cookies['maintenance_bypass'] = 'qa:1abc:forged'
+        self.assertMaintenanceMode(self._get())
+
+    def test_expired_token(self):
+        from maintenancemode.bypass import make_token
+        response = self._get('/?maintenance_bypass=%s' % make_token(), MAINTENANCE_MODE_BYPASS_MAX_AGE=-1)
+        self.assertMaintenanceMode(response)
+        self.assertNotIn('maintenance_bypass', response.cookies)
+
+    def test_wsgi_gate_hands_token_to_django(self):
+        from django.test import RequestFactory
+        from maintenancemode.bypass import make_token
+        from maintenancemode.wsgi import MaintenanceModeGate
+        gate = MaintenanceModeGate(None)
+        environ = RequestFactory().get('/', HTTP_COOKIE='maintenance_bypass=%s' % make_token()).environ
+        self.assertIsNone(gate.get_response(environ))
+        environ = RequestFactory().get('/', HTTP_COOKIE='maintenance_bypass=forged').environ
+        with self.settings(**self.TEMPLATES_WITH):
+            self.assertEqual(gate.get_response(environ).status_code, 503)
+
+    def test_token_command(self):
+        from django.core.management import call_command
+        from django.utils.six import StringIO
+        from maintenancemode.bypass import verify_token
+        out = StringIO()
+        call_command('maintenance', 'token', label='qa', stdout=out)
+        token = out.getvalue().splitlines()[0].split('=', 1)[1]
+        self.assertTrue(verify_token(token))
+
+
+class ExportTestCase(TestDataMixin, TestCase):
+
+    def setUp(self):
+        import tempfile
+        super(ExportTestCase, self).setUp()
+        self._set_model_to(True)
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.root)
+        super(ExportTestCase, self).tearDown()
+
+    def _read(self, *path):
+        with open(os.path.join(self.root, *path)) as f:
+            return f.read()
+
+    def _run_pending_export(self):
+        """ Run the export scheduled by a state change now, instead of in its timer thread """
+        from maintenancemode import export
+        transition = export._timer.args[0]
+        export.cancel_scheduled_export()
+        export.scheduled_export(transition)
+
+    def _passes(self, request_line):
+        """ Evaluate maintenance.map the way nginx does: the first matching regex wins """
+        for line in self._read('maintenance.map').splitlines():
+            match = re.match(r'^    "~(.*)" ([01]);$', line)
+            if match and re.match(match.group(1).replace('\\\\', '\\'), request_line):
+                return match.group(2) == '1'
+        return True
+
+    def test_export_command(self):
+        from django.core.management import call_command
+        from django.utils.six import StringIO
+        IgnoredURL.objects.create(maintenance=self.maintenance, pattern=r'^/ignored/', description='ignored')
+        with self.settings(MAINTENANCE_MODE_EXPORT_LANGUAGES=('hr',), **self.TEMPLATES_WITH):
+            call_command('export_maintenance', self.root, stdout=StringIO())
+        self.assertIn('Temporary unavailable', self._read(self.site.domain, '503.html'))
+        self.assertIn('Temporary unavailable', self._read(self.site.domain, 'hr', '503.html'))
+        self.assertEqual(sorted(os.listdir(os.path.join(self.root, self.site.domain))), ['503.html', 'hr'])
+        self.assertFalse(self._passes('GET:%s:/' % self.site.domain))
+        self.assertTrue(self._passes('GET:%s:/ignored/page/' % self.site.domain))
+        self.assertTrue(self._passes('GET:other.example.org:/'))
+
+    def test_read_only_and_blocked_urls_map(self):
+        from maintenancemode.export import nginx_map
+        from maintenancemode.state import MaintenanceState
+        with open(os.path.join(self.root, 'maintenance.map'), 'w') as f:
+            f.write(nginx_map([
+                MaintenanceState(1, 'a.example.com', is_being_performed=True, read_only=True),
+                MaintenanceState(2, 'b.example.com', blocked_urls=[(r'^/api/', ('POST',))]),
+            ]))
+        self.assertTrue(self._passes('GET:a.example.com:/'))
+        self.assertFalse(self._passes('POST:a.example.com:/'))
+        self.assertTrue(self._passes('GET:b.example.com:/api/'))
+        self.assertFalse(self._passes('POST:b.example.com:/api/'))
+
+    def test_anchored_alternatives_and_ports(self):
+        import logging
+        from maintenancemode.export import nginx_map
+        from maintenancemode.state import MaintenanceState
+        logging.disable(logging.WARNING)
+        try:
+            with open(os.path.join(self.root, 'maintenance.map'), 'w') as f:
+                f.write(nginx_map([
+                    MaintenanceState(1, 'localhost:8000', is_being_performed=True,
+                                     ignored_patterns=[r'^/health/|^/status/', r'^/a/(^/b/)']),
+                    MaintenanceState(2, 'shop.example.com',
+                                     blocked_urls=[(r'(?:^/checkout/|^/cart/)', ('POST',))]),
+                ]))
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertFalse(self._passes('GET:localhost:/'))
+        self.assertTrue(self._passes('GET:localhost:/health/'))
+        self.assertTrue(self._passes('GET:localhost:/status/'))
+        # Left out of the map, nginx sends these requests the 503 page
+        self.assertFalse(self._passes('GET:localhost:/a/'))
+        # A blocked URL the map can't express blocks the whole site for its methods
+        self.assertFalse(self._passes('POST:shop.example.com:/cart/'))
+        self.assertFalse(self._passes('POST:shop.example.com:/account/'))
+        self.assertTrue(self._passes('GET:shop.example.com:/cart/'))
+
+    def test_patterns_are_validated_for_the_map(self):
+        from django.core.exceptions import ValidationError
+        from maintenancemode.models import validate_pattern
+        validate_pattern(r'(?:^/checkout/|^/cart/)')
+        with self.settings(MAINTENANCE_MODE_EXPORT_ROOT=self.root):
+            validate_pattern(r'^/checkout/|^/cart/')
+            self.assertRaises(ValidationError, validate_pattern, r'(?:^/checkout/|^/cart/)')
+
+    def test_export_on_state_change(self):
+        with self.settings(MAINTENANCE_MODE_EXPORT_ROOT=self.root, **self.TEMPLATES_WITH):
+            self.maintenance.is_being_performed = False
+            self.maintenance.save()
+            self._run_pending_export()
+            self.assertTrue(self._passes('GET:%s:/' % self.site.domain))
+            self.maintenance.is_being_performed = True
+            self.maintenance.save()
+            # Not exported on the save itself
+            self.assertTrue(self._passes('GET:%s:/' % self.site.domain))
+            self._run_pending_export()
+            self.assertFalse(self._passes('GET:%s:/' % self.site.domain))
+
+    def test_export_by_command(self):
+        from django.core.management import call_command
+        from django.utils.six import StringIO
+        with self.settings(MAINTENANCE_MODE_EXPORT_ROOT=self.root, **self.TEMPLATES_WITH):
+            call_command('maintenance', 'off', stdout=StringIO())
+            self.assertTrue(self._passes('GET:%s:/' % self.site.domain))
+
+    def test_export_when_scheduled_window_starts(self):
+        """ A scheduled window starts without a save, the export follows it anyway """
+        from datetime import timedelta
+        from django.utils import timezone
+        from maintenancemode import export
+        start = timezone.now() + timedelta(hours=1)
+        with self.settings(MAINTENANCE_MODE_EXPORT_ROOT=self.root, **self.TEMPLATES_WITH):
+            self.maintenance.is_being_performed = False
+            self.maintenance.scheduled_start = start
+            self.maintenance.scheduled_end = start + timedelta(hours=2)
+            self.maintenance.save()
+            self._run_pending_export()
+            self.assertTrue(self._passes('GET:%s:/' % self.site.domain))
+            transition = export._timer.args[0]
+            self.assertAlmostEqual(transition, time.time() + 3600, delta=60)
+            # Not yet: only waits again
+            export.scheduled_export(transition)
+            self.assertTrue(self._passes('GET:%s:/' % self.site.domain))
+            # The window has started, and ends two hours after its original start
+            Maintenance.objects.filter(id=self.maintenance.id).update(
+                scheduled_start=timezone.now() - timedelta(minutes=1))
+            state.invalidate()
+            export.scheduled_export(time.time())
+            self.assertFalse(self._passes('GET:%s:/' % self.site.domain))
+            self.assertAlmostEqual(export._timer.args[0], time.time() + 3 * 3600, delta=60)
+        self.assertIsNone(export._timer)
+
+
+class RampTestCase(TestDataMixin, TestCase):
+
+    def setUp(self):
+        super(RampTestCase, self).setUp()
+        self._set_model_to(True)
+
+    def _set_ramp(self, start, end, ramp_from, ramp_to):
+        from datetime import timedelta
+        from django.utils import timezone
+        now = timezone.now()
+        Maintenance.objects.filter(id=self.maintenance.id).update(
+            ramp_start=now + timedelta(seconds=start), ramp_end=now + timedelta(seconds=end),
+            ramp_from=ramp_from, ramp_to=ramp_to,
+        )
+        state.invalidate()
+
+    def _get(self, bucket=None):
+        from maintenancemode.ramp import make_cookie_value
+        if bucket is not None:
+            self.client.cookies['maintenance_bucket'] = make_cookie_value(bucket)
+        with self.settings(**self.TEMPLATES_WITH):
+            return self.client.get('/')
+
+    def test_ramp_percentage(self):
+        from maintenancemode.state import MaintenanceState
+        now = time.time()
+        ramp = MaintenanceState(is_being_performed=True, ramp=(now - 50, now + 50, 0, 100))
+        self.assertAlmostEqual(ramp.ramp_percentage(), 50, delta=1)
+        ramp = MaintenanceState(is_being_performed=True, ramp=(now + 50, now + 100, 20, 100))
+        self.assertEqual(ramp.ramp_percentage(), 20)
+        self.assertIsNone(MaintenanceState(is_being_performed=False, ramp=(now, now + 1, 0, 100)).ramp)
+
+    def test_buckets_below_percentage_get_maintenance(self):
+        self._set_ramp(-100, -50, 0, 50)
+        self.assertMaintenanceMode(self._get(bucket=10))
+        self.assertNormalMode(self._get(bucket=90))
+        with self.assertNumQueries(0):
+            self._get(bucket=10)
+
+    def test_full_ramp(self):
+        self._set_ramp(-100, -50, 0, 100)
+        self.assertMaintenanceMode(self._get(bucket=99))
+        self._set_ramp(-100, -50, 100, 0)
+        self.assertNormalMode(self._get(bucket=0))
+
+    def test_bucket_is_kept_in_cookie(self):
+        from maintenancemode.ramp import get_bucket_from, make_cookie_value
+        self._set_ramp(-100, -50, 0, 0)
+        response = self._get()
+        self.assertNormalMode(response)
+        self.assertEqual(response.cookies['maintenance_bucket'].value,
+                         make_cookie_value(get_bucket_from({}, {'REMOTE_ADDR': '127.0.0.1'})))
+
+    def test_forged_bucket_is_ignored(self):
+        from maintenancemode.ramp import get_bucket_from
+        address = {'REMOTE_ADDR': '127.0.0.1'}
+        bucket = get_bucket_from({}, address)
+        forged = (bucket + 50) % 100
+        self.assertEqual(get_bucket_from({'maintenance_bucket': str(forged)}, address), bucket)
+        self.assertEqual(get_bucket_from({'maintenance_bucket': 'x'}, address), bucket)
+        # A descending ramp, which the forged bucket would stay out of
+        self._set_ramp(-100, -50, 100, bucket + 1)
+        self.client.cookies['maintenance_bucket'] = str(99)
+        self.assertMaintenanceMode(self._get())
+
+    def test_no_ramp_without_maintenance(self):
+        self._set_model_to(False)
+        self._set_ramp(-100, -50, 0, 100)
+        response = self._get()
+        self.assertNormalMode(response)
+        self.assertNotIn('maintenance_bucket', response.cookies)
+
+    def test_clean(self):
+        from datetime import timedelta
+        from django.core.exceptions import ValidationError
+        from django.utils import timezone
+        self.maintenance.ramp_start = timezone.now()
+        self.assertRaises(ValidationError, self.maintenance.clean)
+        self.maintenance.ramp_end = self.maintenance.ramp_start - timedelta(minutes=1)
+        self.assertRaises(ValidationError, self.maintenance.clean)
+        self.maintenance.ramp_end = self.maintenance.ramp_start + timedelta(minutes=10)
+        self.maintenance.clean()
+
+
+class RateLimitTestCase(TestDataMixin, TestCase):
+
+    def setUp(self):
+        super(RateLimitTestCase, self).setUp()
+        self._set_model_to(True)
+        IgnoredURL.objects.create(maintenance=self.maintenance, pattern=r'^/ignored/',
+                                  description='webhooks', rate_limit=60, burst=2)
+
+    def _get_ignored(self, times, alias=None):
+        # Changing the setting also starts with fresh buckets
+        with self.settings(MAINTENANCE_MODE_RATE_LIMIT_CACHE_ALIAS=alias, **self.TEMPLATES_WITH):
+            return [self.client.get('/ignored/') for i in range(times)]
+
+    def test_requests_over_limit_get_maintenance_page(self):
+        responses = self._get_ignored(3)
+        self.assertEqual([response.status_code for response in responses], [200, 200, 503])
+        self.assertMaintenanceMode(responses[2])
+        self.assertEqual(responses[2]['Retry-After'], '1')
+
+    def test_shared_cache_limit(self):
+        from django.core.cache import caches
+        caches['default'].clear()
+        responses = self._get_ignored(3, alias='default')
+        self.assertEqual([response.status_code for response in responses], [200, 200, 503])
+
+    def test_unlimited_patterns(self):
+        IgnoredURL.objects.filter(maintenance=self.maintenance).update(rate_limit=None)
+        state.invalidate()
+        self.assertEqual([response.status_code for response in self._get_ignored(5)], [200] * 5)
+
+    def test_bucket_refills(self):
+        from maintenancemode.ratelimit import LocalRateLimiter
+        limiter = LocalRateLimiter()
+        self.assertTrue(limiter.acquire('key', 100, 1))
+        self.assertFalse(limiter.acquire('key', 100, 1))
+        time.sleep(0.02)
+        self.assertTrue(limiter.acquire('key', 100, 1))
+
+    def test_wsgi_gate_counts_requests_once(self):
+        from django.test import RequestFactory
+        from maintenancemode.middleware import MaintenanceModeMiddleware
+        from maintenancemode.ratelimit import ADMITTED_KEY
+        from maintenancemode.wsgi import MaintenanceModeGate
+        gate, middleware = MaintenanceModeGate(None), MaintenanceModeMiddleware()
+        with self.settings(MAINTENANCE_MODE_RATE_LIMIT_CACHE_ALIAS=None, **self.TEMPLATES_WITH):
+            for i in range(2):
+                environ = RequestFactory().get('/ignored/').environ
+                self.assertIsNone(gate.get_response(environ))
+                request = RequestFactory().get('/ignored/', **{ADMITTED_KEY: '^/ignored/'})
+                self.assertIsNone(middleware.process_request(request))
+            environ = RequestFactory().get('/ignored/').environ
+            self.assertEqual(gate.get_response(environ).status_code, 503)
+
+
+class EventsTestCase(TestDataMixin, TestCase):
+
+    def setUp(self):
+        super(EventsTestCase, self).setUp()
+        self._set_model_to(False)
+
+    def _wait_for(self, condition):
+        for i in range(100):
+            if condition():
+                return
+            time.sleep(0.01)
+        self.fail('Timed out')
+
+    def test_listener_reloads_state_without_polling(self):
+        from maintenancemode import events
+        with self.settings(MAINTENANCE_MODE_EVENT_CHANNEL='maintenancemode.events.InMemoryChannel',
+                           MAINTENANCE_MODE_STATE_TTL=0, **self.TEMPLATES_WITH):
+            self.assertNormalMode(self.client.get('/'))
+            self._wait_for(events.is_listening)
+            self.client.get('/')
+            with self.assertNumQueries(0):
+                self.assertNormalMode(self.client.get('/'))
+            # Saving the model publishes an event, which reloads the state
+            self.maintenance.is_being_performed = True
+            self.maintenance.save()
+            with self.assertNumQueries(0):
+                self.assertMaintenanceMode(self.client.get('/'))
+            # An update() sends no event, until published by hand
+            Maintenance.objects.filter(id=self.maintenance.id).update(is_being_performed=False)
+            self.assertMaintenanceMode(self.client.get('/'))
+            events.publish()
+            self.assertNormalMode(self.client.get('/'))
+        self.assertFalse(events.is_listening())
+
+    def test_load_started_before_reload_is_not_cached(self):
+        """ A request which read the state before a change doesn't replace the reloaded state """
+        from maintenancemode.backends import get_backend
+        backend = get_backend()
+        load = backend.load
+
+        def load_during_change(generation=None):
+            snapshot = load(generation)
+            del backend.load
+            Maintenance.objects.filter(id=self.maintenance.id).update(is_being_performed=True)
+            state.reload()  # as the listener does when the change event arrives
+            return snapshot
+
+        state.invalidate()
+        backend.load = load_during_change
+        try:
+            self.assertFalse(state.get_state(self.site).is_being_performed)
+        finally:
+            backend.__dict__.pop('load', None)
+        self.assertTrue(state.get_state(self.site).is_being_performed)
+
+    def test_unix_socket_channel(self):
+        import shutil
+        import socket
+        import tempfile
+        import threading
+        from maintenancemode.events import UnixSocketChannel
+        directory = tempfile.mkdtemp()
+        try:
+            # A socket left behind by a process which is gone
+            stale = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            stale.bind(os.path.join(directory, 'stale.sock'))
+            stale.close()
+            with self.settings(MAINTENANCE_MODE_EVENT_SOCKET_DIR=directory):
+                channel = UnixSocketChannel()
+            messages, ready = [], threading.Event()
+            listener = threading.Thread(target=channel.listen, args=(messages.append, ready.set))
+            listener.start()
+            try:
+                ready.wait(1)
+                channel.publish('changed')
+                self._wait_for(lambda: messages)
+            finally:
+                channel.close()
+                listener.join()
+            self.assertEqual(messages, ['changed'])
+            self.assertEqual(os.listdir(directory), [])
+        finally:
+            shutil.rmtree(directory)
+
+
+class IgnoredURLBulkTestCase(TestDataMixin, TestCase):
+
+    def setUp(self):
+        super(IgnoredURLBulkTestCase, self).setUp()
+        from maintenancemode.events import InMemoryChannel
+        self.announced = []
+        InMemoryChannel.callbacks.append(self.announced.append)
+        self.addCleanup(InMemoryChannel.callbacks.remove, self.announced.append)
+
+    def _import(self, text, format='csv', replace=False):
+        from maintenancemode.bulk import import_ignored_urls
+        with self.settings(MAINTENANCE_MODE_EVENT_CHANNEL='maintenancemode.events.InMemoryChannel'):
+            return import_ignored_urls(self.maintenance, text, format, replace=replace)
+
+    def test_invalid_pattern(self):
+        from django.core.exceptions import ValidationError
+        ignored_url = IgnoredURL(maintenance=self.maintenance, pattern='^/broken/(')
+        self.assertRaises(ValidationError, ignored_url.full_clean)
+        # Saved anyway (e.g. by a data migration), it never matches and breaks nothing else
+        import logging
+        logging.disable(logging.WARNING)
+        try:
+            matcher = URLMatcher(['^/broken/(', '^/ok/'])
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertEqual(matcher.patterns, ('^/ok/',))
+        self.assertIsNone(matcher.match('/broken/('))
+        self.assertEqual(matcher.match('/ok/'), '^/ok/')
+
+    def test_import_csv(self):
+        count = self._import('pattern,description,rate_limit,burst\n'
+                             '^/api/,API,,\n'
+                             '^/health/$,Health check,60,10\n')
+        self.assertEqual(count, 2)
+        health = IgnoredURL.objects.get(pattern='^/health/$')
+        self.assertEqual((health.description, health.rate_limit, health.burst), ('Health check', 60, 10))
+        self.assertEqual(len(self.announced), 1)
+
+    def test_import_json_replace(self):
+        IgnoredURL.objects.create(maintenance=self.maintenance, pattern='^/old/', description='Old')
+        self._import('[{"pattern": "^/a/", "description": "A"},'
+                     ' {"pattern": "^/b/", "description": "B", "rate_limit": 5}]', 'json', replace=True)
+        self.assertEqual(sorted(self.maintenance.ignoredurl_set.values_list('pattern', flat=True)),
+                         ['^/a/', '^/b/'])
+        # One announcement for the deleted and the created rows together
+        self.assertEqual(len(self.announced), 1)
+
+    def test_import_invalid_rows(self):
+        from django.core.exceptions import ValidationError
+        with self.assertRaises(ValidationError) as cm:
+            self._import('^/ok/,OK\n^/broken/(,Broken\n^/limited/,Limited,many\n')
+        self.assertEqual(len(cm.exception.messages), 2)
+        self.assertIn('Row 2 (^/broken/()', cm.exception.messages[0])
+        self.assertFalse(IgnoredURL.objects.exists())
+        self.assertRaises(ValidationError, self._import, '{"pattern": "^/a/", "description": "A"}', 'json')
+        self.assertEqual(self.announced, [])
+
+    def test_export_roundtrip(self):
+        from maintenancemode.bulk import export_ignored_urls
+        self._import(u'^/caf\xe9/,Caf\xe9,,\n^/api/,"API, v1",30,\n')
+        for format in ('csv', 'json'):
+            exported = export_ignored_urls(self.maintenance, format)
+            self._import(exported, format, replace=True)
+            self.assertEqual(export_ignored_urls(self.maintenance, format), exported)
+        self.assertEqual(list(self.maintenance.ignoredurl_set.order_by('pattern').values_list(
+            'pattern', 'description', 'rate_limit', 'burst')),
+            [(u'^/api/', u'API, v1', 30, None), (u'^/caf\xe9/', u'Caf\xe9', None, None)])
+
+    def test_batched_changes(self):
+        with self.settings(MAINTENANCE_MODE_EVENT_CHANNEL='maintenancemode.events.InMemoryChannel'):
+            with state.batched_changes():
+                for i in range(5):
+                    IgnoredURL.objects.create(maintenance=self.maintenance, pattern='^/%d/' % i)
+                with state.batched_changes():
+                    BlockedURL.objects.create(maintenance=self.maintenance, pattern='^/blocked/')
+                self.assertEqual(self.announced, [])
+            self.assertEqual(len(self.announced), 1)
+            IgnoredURL.objects.create(maintenance=self.maintenance, pattern='^/single/')
+            self.assertEqual(len(self.announced), 2)
+
+    def test_admin(self):
+        from maintenancemode.admin import MAX_INLINE_IGNORED_URLS
+        self.client.login(username='super_user', password='maintenance_pw')
+        url = '/admin/maintenancemode/maintenance/%d/' % self.maintenance.pk
+        with self.settings(MAINTENANCE_MODE_EVENT_CHANNEL='maintenancemode.events.InMemoryChannel'):
+            response = self.client.post(url + 'ignored-urls/import/', {
+                'format': 'csv', 'text': '^/broken/(,Broken\n',
+            })
+            self.assertContains(response, 'Invalid regular expression')
+            response = self.client.post(url + 'ignored-urls/import/', {
+                'format': 'csv', 'text': '\n'.join('^/api/%d/,API' % i for i in range(MAX_INLINE_IGNORED_URLS + 1)),
+            })
+            self.assertRedirects(response, url)
+        self.assertEqual(len(self.announced), 1)
+
+        # Too many ignored URLs for the inline
+        response = self.client.get(url)
+        self.assertContains(response, 'too many to edit here')
+        self.assertNotContains(response, 'ignoredurl_set-0-pattern')
+
+        response = self.client.get(url + 'ignored-urls/export/', {'format': 'json'})
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('^/api/50/', response.content.decode('utf-8'))
+
+        response = self.client.get(url + 'test-pattern/', {'path': '/api/7/status/', 'method': 'GET'})
+        self.assertContains(response, '<code>^/api/7/</code>')
+        self.assertContains(response, 'passes through, not in maintenance')
+
+        # Ignored URLs pass through maintenance, within their rate limit
+        self._set_model_to(True)
+        IgnoredURL.objects.filter(pattern='^/api/7/').update(rate_limit=30, burst=5)
+        state.invalidate()
+        response = self.client.get(url + 'test-pattern/', {'path': '/api/7/status/', 'method': 'GET'})
+        self.assertContains(response, 'passes through the ignored URL, up to 30 requests per minute')
+        response = self.client.get(url + 'test-pattern/', {'path': '/other/', 'method': 'GET'})
+        self.assertContains(response, 'maintenance page')
+
+        self.client.login(username='staff_user', password='maintenance_pw')
+        self.assertEqual(self.client.get(url + 'test-pattern/').status_code, 403)
+
+
+class WSGIGateTestCase(TestDataMixin, TestCase):
+
+    def setUp(self):
+        from maintenancemode.wsgi import MaintenanceModeGate
+        super(WSGIGateTestCase, self).setUp()
+        self._set_model_to(True)
+        self.gate = MaintenanceModeGate(self._django_application)
+
+    def _django_application(self, environ, start_response):
+        start_response('200 OK', [('Content-Type', 'text/plain')])
+        return [b'Rendered response page']
+
+    def _call(self, path='/', **extra):
+        from django.test import RequestFactory
+        environ = RequestFactory().get(path, **extra).environ
+        status = []
+        with self.settings(**self.TEMPLATES_WITH):
+            body = b''.join(self.gate(environ, lambda s, headers: status.append(s)))
+        return status[0], body
+
+    def test_anonymous_request_is_answered_by_gate(self):
+        status, body = self._call()
+        self.assertEqual(status, '503 SERVICE UNAVAILABLE')
+        self.assertIn(b'Temporary unavailable', body)
+
+    def test_request_with_session_is_handed_to_django(self):
+        status, body = self._call(HTTP_COOKIE='%s=abc' % settings.SESSION_COOKIE_NAME)
+        self.assertEqual(status, '200 OK')
+
+    def test_ignored_url_is_handed_to_django(self):
+        IgnoredURL.objects.create(maintenance=self.maintenance, pattern=r'^/ignored/',
+                                  description='ignored')
+        self.assertEqual(self._call('/ignored/')[0], '200 OK')
+
+    def test_disabled_maintenance_is_handed_to_django(self):
+        self._set_model_to(False)
+        self.assertEqual(self._call()[0], '200 OK')
+
+    def test_permission_processors_without_user(self):
+        """ Processors which don't need a user are asked, the others are skipped """
+        del processor_calls[:]
+        with self.settings(MAINTENANCE_MODE_PERMISSION_PROCESSORS=(
+                'testapp.tests.user_processor', 'testapp.tests.header_processor')):
+            self.assertEqual(self._call(HTTP_X_MONITORING='secret')[0], '200 OK')
+            self.assertEqual(self._call()[0], '503 SERVICE UNAVAILABLE')
+        self.assertEqual(processor_calls, ['header', 'header'])
+
+    def test_processor_reading_user_sees_anonymous_user(self):
+        del processor_calls[:]
+        with self.settings(MAINTENANCE_MODE_PERMISSION_PROCESSORS=(
+                'testapp.tests.legacy_processor',)):
+            self.assertEqual(self._call()[0], '503 SERVICE UNAVAILABLE')
+        self.assertEqual(processor_calls, ['legacy'])
+
+
+class HttpResponseTemporaryUnavailableTestCase(SimpleTestCase):
+
+    def test_positional_arguments_of_http_response(self):
+        from maintenancemode.http import HttpResponseTemporaryUnavailable
+        response = HttpResponseTemporaryUnavailable('Down', 'text/plain')
+        self.assertEqual((response.status_code, response['Content-Type']), (503, 'text/plain'))
+        self.assertNotIn('Retry-After', response)
+
+    def test_headers(self):
+        from datetime import datetime
+        from django.utils import timezone
+        from maintenancemode.http import HttpResponseTemporaryUnavailable
+        response = HttpResponseTemporaryUnavailable(b'', retry_after=30, etag='abc', cache_control='no-cache')
+        self.assertEqual((response['Retry-After'], response['ETag'], response['Cache-Control']),
+                         ('30', '"abc"', 'no-cache'))
+        response = HttpResponseTemporaryUnavailable(
+            retry_after=datetime(2015, 6, 10, 4, tzinfo=timezone.utc), etag='W/"abc"')
+        self.assertEqual((response['Retry-After'], response['ETag']),
+                         ('Wed, 10 Jun 2015 04:00:00 GMT', 'W/"abc"'))
+
+
+class ScheduleTestCase(SimpleTestCase):
+
+    def _dt(self, day, hour, minute=0):
+        from datetime import datetime
+        from django.utils import timezone
+        return datetime(2015, 6, day, hour, minute, tzinfo=timezone.utc)
+
+    def test_once(self):
+        from maintenancemode.schedule import Schedule
+        schedule = Schedule(self._dt(10, 2), self._dt(10, 4))
+        self.assertEqual(schedule.window(self._dt(9, 12)), (False, self._dt(10, 2)))
+        self.assertEqual(schedule.window(self._dt(10, 3)), (True, self._dt(10, 4)))
+        self.assertEqual(schedule.window(self._dt(10, 4)), (False, None))
+
+    def test_daily(self):
+        from django.utils import timezone
+        from maintenancemode.schedule import Schedule, DAILY
+        schedule = Schedule(self._dt(10, 2), self._dt(10, 4), DAILY, timezone.utc)
+        self.assertEqual(schedule.window(self._dt(12, 3, 30)), (True, self._dt(12, 4)))
+        self.assertEqual(schedule.window(self._dt(12, 4)), (False, self._dt(13, 2)))
+        self.assertEqual(schedule.window(self._dt(12, 1)), (False, self._dt(12, 2)))
+
+
+class NetworkSetTestCase(SimpleTestCase):
+
+    def test_membership(self):
+        networks = NetworkSet(['10.0.0.0/8', '10.128.0.0/9', '192.168.1.1', '2001:db8::/32'])
+        self.assertEqual(len(networks), 3)  # the two 10.x networks are merged
+        for address in ('10.0.0.0', '10.255.255.255', '192.168.1.1', '::ffff:10.0.0.1', '2001:db8::5'):
+            self.assertIn(address, networks)
+        for address in ('11.0.0.0', '192.168.1.2', '2001:db9::', 'not an address', ''):
+            self.assertNotIn(address, networks)
+
+
+class URLMatcherTestCase(SimpleTestCase):
+
+    patterns = [
+        r'^/ignored/', r'^/api/v\d+/health$', r'/status$', r'.*\.json$', r'^/(a|b)/(\d+)/\2',
+        r'^/x/(?P<n>\d+)', r'^/y/(?P<n>\d+)', r'(?i)^/CaSe', r'^/lit\.txt$', r'/colou?r',
+    ] + [r'^/p%d/(\d+)' % i for i in range(150)]
+
+    def test_split_literal_prefix(self):
+        self.assertEqual(split_literal_prefix(r'^/api/v\d+/'), ('/api/v', r'\d+/'))
+        self.assertEqual(split_literal_prefix(r'^/colou?r'), ('/colo', 'u?r'))
+        self.assertEqual(split_literal_prefix(r'^/a\.b$'), ('/a.b', '$'))
+        self.assertEqual(split_literal_prefix(r'(?i)^/a'), ('', r'(?i)^/a'))
+        self.assertEqual(split_literal_prefix(r'^/a|^/b'), ('', r'^/a|^/b'))
+
+    def test_matches_like_re_match(self):
+        """ The matcher should agree with trying every pattern with re.match """
+        matcher = URLMatcher(self.patterns)
+        paths = [
+            '/ignored/x', '/api/v2/health', '/api/v2/health/', '/status', '/x.json', '/a/1/1',
+            '/b/2/3', '/x/5', '/y/5', '/case', '/lit.txt', '/litxtxt', '/color', '/colr',
+            '/p7/3', '/p149/9', '/p150/1', '/nothing', '',
+        ]
+        for path in paths:
+            expected = [pattern for pattern in self.patterns if re.match(pattern, path)]
+            self.assertEqual(matcher.match(path), expected[0] if expected else None, path)
+
+    def test_first_declared_pattern_wins(self):
+        """ Rate limits are keyed by the matched pattern, a broad prefix mustn't shadow an earlier one """
+        patterns = [r'^/api/v\d+/', r'(?i)^/API/', r'^/api/', r'^/', r'.*']
+        for i in range(len(patterns)):
+            declared = patterns[i:] + patterns[:i]
+            matcher = URLMatcher(declared)
+            for path in ('/api/v2/', '/api/x', '/x'):
+                expected = [pattern for pattern in declared if re.match(pattern, path)]
+                self.assertEqual(matcher.match(path), expected[0], (declared, path))
+
+
+class MethodURLMatcherTestCase(SimpleTestCase):
+
+    def test_match(self):
+        matcher = MethodURLMatcher([(r'^/checkout/', ('POST',)), (r'^/api/v2/', ())])
+        self.assertEqual(matcher.match('POST', '/checkout/pay/'), r'^/checkout/')
+        self.assertIsNone(matcher.match('GET', '/checkout/pay/'))
+        self.assertEqual(matcher.match('GET', '/api/v2/items/'), r'^/api/v2/')
+        self.assertEqual(matcher.match('DELETE', '/api/v2/items/'), r'^/api/v2/')
+        self.assertIsNone(matcher.match('POST', '/'))
+
 
 class PermissionsTestCase(TestDataMixin, TestCase):
 
@@ -177,6 +1521,7 @@ class PermissionsTestCase(TestDataMixin, TestCase):
         """ Reset config options adapted in the individual tests """
         super(PermissionsTestCase, self).setUp()
         self._set_model_to(True)
+        del processor_calls[:]
 
     def test_superuser_permission_with_staff_user(self):
         """ Setting settings so that only superusers can see the site,
@@ -202,3 +1547,58 @@ class PermissionsTestCase(TestDataMixin, TestCase):
             self.client.login(username='super_user', password='maintenance_pw')
             response = self.client.get('/')
         self.assertNormalMode(response)
+
+    def test_processor_timing(self):
+        """ With PROCESSOR_TIMING enabled, every processor call should be accounted for """
+        from maintenancemode.registry import permission_processors
+        self.client.login(username='user', password='maintenance_pw')
+        with self.settings(MAINTENANCE_MODE_PROCESSOR_TIMING=True, **self.TEMPLATES_WITH):
+            self.client.get('/')
+            self.client.get('/')
+            calls, total = permission_processors.timings['maintenancemode.permission_processors.is_staff']
+        self.assertEqual(calls, 2)
+        self.assertGreaterEqual(total, 0)
+
+    def _check_with(self, processors, request):
+        from maintenancemode.middleware import MaintenanceModeMiddleware
+        with self.settings(MAINTENANCE_MODE_PERMISSION_PROCESSORS=processors):
+            return MaintenanceModeMiddleware().check(request, state.get_current_state(request))
+
+    def test_cheapest_processor_first(self):
+        from django.test import RequestFactory
+        result = self._check_with(('testapp.tests.expensive_processor', 'testapp.tests.cheap_processor'),
+                                  RequestFactory().get('/'))
+        self.assertEqual(result, metrics.PERMISSION_PROCESSOR)
+        self.assertEqual(processor_calls, ['cheap'])
+
+    def test_processor_results_are_memoized_per_request(self):
+        from django.test import RequestFactory
+        request = RequestFactory().get('/')
+        processors = ('testapp.tests.expensive_processor',)
+        self.assertEqual(self._check_with(processors, request), metrics.BLOCKED)
+        self.assertEqual(self._check_with(processors, request), metrics.BLOCKED)
+        self.assertEqual(processor_calls, ['expensive'])
+        self._check_with(processors, RequestFactory().get('/'))
+        self.assertEqual(processor_calls, ['expensive', 'expensive'])
+
+    def test_user_processors_skipped_without_session(self):
+        from django.contrib.auth.middleware import AuthenticationMiddleware
+        from django.contrib.sessions.middleware import SessionMiddleware
+        from django.test import RequestFactory
+        from django.utils.functional import empty
+        request = RequestFactory().get('/')
+        SessionMiddleware().process_request(request)
+        AuthenticationMiddleware().process_request(request)
+        state.get_current_state(request)
+        with self.assertNumQueries(0):
+            self.assertEqual(self._check_with(('testapp.tests.user_processor',), request), metrics.BLOCKED)
+        self.assertEqual(processor_calls, [])
+        self.assertIs(request.user._wrapped, empty)
+
+    def test_user_processors_called_for_loaded_user(self):
+        from django.test import RequestFactory
+        request = RequestFactory().get('/')
+        request.user = self.staff_user
+        result = self._check_with(('testapp.tests.user_processor',), request)
+        self.assertEqual(result, metrics.PERMISSION_PROCESSOR)
+        self.assertEqual(processor_calls, ['user'])
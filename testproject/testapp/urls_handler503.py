@@ -0,0 +1,3 @@
+from testproject.urls import urlpatterns
+
+handler503 = 'testapp.views.unavailable'
@@ -5,3 +5,6 @@ def index(request):
 
 def ignored(request):
     return HttpResponse('Rendered response page, ignored')
+
+def unavailable(request):
+    return HttpResponse('Custom maintenance page', status=503)